@@ -6,23 +6,29 @@ Supports:
   - Single file processing: python main.py -i invoice.png -o result.json
   - Batch folder processing: python main.py -i train/ -o results.json
   - Method selection: --method hybrid|gemini|ocr
+  - Resumable batches: results stream to <output>.jsonl and are skipped on re-run
   
 Supported Formats:
   - Images: PNG, JPG, JPEG, BMP, TIFF, WEBP, GIF
-  - Documents: PDF (converts each page to image)
+  - Documents: PDF (renders each page to an in-memory image)
 """
 
-import json
 import sys
 import os
-import tempfile
+import importlib.util
+import io
+import queue
+import threading
 from pathlib import Path
 from datetime import datetime
-from modules.hybrid_engine import HybridExtractor
+from typing import Any, NamedTuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from modules.hybrid_engine import get_hybrid_extractor, get_gemini_extractor, get_easyocr_extractor
 from modules.gemini_extractor import GeminiExtractor
-from modules.ocr_extractor import EasyOCRExtractor
-from modules.config import API_KEYS
-from modules.key_manager import RoundRobinKeyManager
+from modules import _json
+from modules.result import ExtractResult, load_completed
+from modules.pool import bounded_completion, MAX_IN_FLIGHT_PER_WORKER
+import numpy as np
 
 # Try to import PDF libraries
 try:
@@ -41,25 +47,31 @@ except ImportError:
 #                              OUTPUT FORMATTING
 # ═══════════════════════════════════════════════════════════════════════════════
 
+# Box-drawing rules (built once, reused by every print)
+_BOX_RULE = "+" + "-" * 68 + "+"
+_BOX_BLANK = "|" + " " * 68 + "|"
+_RULE = "-" * 70
+_HEAVY_RULE = "=" * 70
+
 def print_header():
     """Print application header"""
-    print("\n" + "=" * 70)
-    print("|" + " " * 68 + "|")
+    print("\n" + _HEAVY_RULE)
+    print(_BOX_BLANK)
     print("|" + "   IDFC GenAI - Hybrid Document AI Extractor   ".center(68) + "|")
-    print("|" + " " * 68 + "|")
-    print("=" * 70)
+    print(_BOX_BLANK)
+    print(_HEAVY_RULE)
 
 
 def print_config(method: str, input_path: str, output_path: str, file_count: int):
     """Print configuration summary"""
-    print("\n+" + "-" * 68 + "+")
+    print("\n" + _BOX_RULE)
     print("|" + " CONFIGURATION ".center(68) + "|")
-    print("+" + "-" * 68 + "+")
+    print(_BOX_RULE)
     print(f"|  Method         : {method.upper():<47} |")
     print(f"|  Input          : {input_path:<47} |")
     print(f"|  Output         : {output_path:<47} |")
     print(f"|  Files Found    : {file_count:<47} |")
-    print("+" + "-" * 68 + "+")
+    print(_BOX_RULE)
 
 
 def print_single_result(output: dict):
@@ -69,27 +81,27 @@ def print_single_result(output: dict):
         signature = fields.get('signature', {})
         stamp = fields.get('stamp', {})
         
-        print("\n+" + "-" * 68 + "+")
+        print("\n" + _BOX_RULE)
         print("|" + " EXTRACTION RESULTS ".center(68) + "|")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         print(f"|  Document ID    : {str(output.get('doc_id', 'N/A')):<45} |")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         print("|" + " EXTRACTED FIELDS ".center(68) + "|")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         print(f"|  Dealer Name    : {str(fields.get('dealer_name') or 'Not Found'):<45} |")
         print(f"|  Model Name     : {str(fields.get('model_name') or 'Not Found'):<45} |")
         print(f"|  Horse Power    : {str(fields.get('horse_power') or 'Not Found'):<45} |")
         print(f"|  Asset Cost     : {str(fields.get('asset_cost') or 'Not Found'):<45} |")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         print("|" + " VERIFICATION ".center(68) + "|")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         sig_status = "YES" if signature.get('present') else "NO"
         stamp_status = "YES" if stamp.get('present') else "NO"
         print(f"|  Signature      : {sig_status:<45} |")
         print(f"|  Stamp          : {stamp_status:<45} |")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         print("|" + " METADATA ".center(68) + "|")
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         
         confidence = float(output.get('confidence', 0))
         conf_bar = "#" * int(confidence * 10) + "." * (10 - int(confidence * 10))
@@ -100,7 +112,7 @@ def print_single_result(output: dict):
         cost = float(output.get('cost_estimate_usd', 0))
         print(f"|  Cost Estimate  : ${cost:.4f}{'':<42} |")
         
-        print("+" + "-" * 68 + "+")
+        print(_BOX_RULE)
         
     except Exception as e:
         import traceback
@@ -108,32 +120,47 @@ def print_single_result(output: dict):
         traceback.print_exc()
 
 
-def print_batch_summary(results: list, output_path: str):
-    """Print formatted summary for batch processing"""
+def summarize_results(results: list) -> tuple:
+    """Single pass over batch results: (successful, confidence_sum, total_time, total_cost)"""
+    successful = 0
+    conf_sum = total_time = total_cost = 0.0
+    for r in results:
+        conf = r.get('confidence', 0)
+        successful += conf > 0
+        conf_sum += conf
+        total_time += r.get('processing_time_sec', 0)
+        total_cost += r.get('cost_estimate_usd', 0)
+    return successful, conf_sum, total_time, total_cost
+
+
+def print_batch_summary(results: list, output_path: str, details: bool = True):
+    """Print formatted summary for batch processing (per-document lines unless details=False)"""
     total = len(results)
-    successful = sum(1 for r in results if r.get('confidence', 0) > 0)
+    successful, conf_sum, total_time, total_cost = summarize_results(results)
     failed = total - successful
-    avg_confidence = sum(r.get('confidence', 0) for r in results) / total if total > 0 else 0
-    total_time = sum(r.get('processing_time_sec', 0) for r in results)
-    total_cost = sum(r.get('cost_estimate_usd', 0) for r in results)
+    avg_confidence = conf_sum / total if total > 0 else 0
     
-    print("\n" + "-" * 70)
+    print("\n" + _RULE)
     print(" BATCH PROCESSING SUMMARY ".center(70))
-    print("-" * 70)
+    print(_RULE)
     print(f" Total Documents   : {total}")
     print(f" Successful        : {successful}")
     print(f" Failed            : {failed}")
-    print("-" * 70)
+    print(_RULE)
     print(" STATISTICS ".center(70))
-    print("-" * 70)
+    print(_RULE)
     conf_bar = "#" * int(avg_confidence * 10) + "." * (10 - int(avg_confidence * 10))
     print(f"|  Avg Confidence    : [{conf_bar}] {avg_confidence:.1%} {'':<22} |")
     print(f"|  Total Time        : {total_time:.2f} seconds{'':<31} |")
     print(f"|  Avg Time/Doc      : {(total_time/total if total else 0):.2f} seconds{'':<31} |")
     print(f"|  Total Cost        : ${total_cost:.4f}{'':<38} |")
-    print("+" + "-" * 68 + "+")
+    print(_BOX_RULE)
+    
+    if not details:
+        return
+    
     print("|" + " DOCUMENT RESULTS ".center(68) + "|")
-    print("+" + "-" * 68 + "+")
+    print(_BOX_RULE)
     
     # Show each document result briefly
     for i, result in enumerate(results[:10]):  # Show first 10
@@ -148,65 +175,110 @@ def print_batch_summary(results: list, output_path: str):
     if total > 10:
         print(f"|  ... and {total - 10} more documents{'':<41} |")
     
-    print("+" + "-" * 68 + "+")
+    print(_BOX_RULE)
 
 
 def print_footer(output_path: str):
     """Print footer with output location"""
-    print("\n+" + "-" * 68 + "+")
+    print("\n" + _BOX_RULE)
     print(f"|  Results saved to: {output_path:<43} |")
     print(f"|  Completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S'):<46} |")
-    print("+" + "-" * 68 + "+\n")
+    print(_BOX_RULE + "\n")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #                              FILE HANDLING
 # ═══════════════════════════════════════════════════════════════════════════════
 
-# Supported file formats
-IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif', '.webp', '.gif',
-                    '.PNG', '.JPG', '.JPEG', '.BMP', '.TIFF', '.TIF', '.WEBP', '.GIF']
-PDF_EXTENSIONS = ['.pdf', '.PDF']
-ALL_EXTENSIONS = IMAGE_EXTENSIONS + PDF_EXTENSIONS
+# Supported file formats (lowercase; compare against the lowered suffix)
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif', '.webp', '.gif'}
+PDF_EXTENSIONS = {'.pdf'}
+ALL_EXTENSIONS = IMAGE_EXTENSIONS | PDF_EXTENSIONS
+
+# Default number of parallel workers for batch processing
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Default PDF render resolution (sufficient for invoice OCR)
+DEFAULT_RENDER_DPI = 200
+
+
+class DocumentImage(NamedTuple):
+    """A document to extract: image is a file path, encoded bytes or a pixel array"""
+    doc_id: str
+    source_file: str
+    image: Any
+
 
+class PdfPage(NamedTuple):
+    """A PDF page rendered only when its document is extracted"""
+    pdf_path: str
+    page_num: int
+    dpi: int
+    grayscale: bool
 
-def convert_pdf_to_images(pdf_path: str, output_dir: str = None) -> list:
+
+def _source_info(source) -> DocumentImage:
+    """Normalize an image path or DocumentImage (the Path is built only once)"""
+    if isinstance(source, DocumentImage):
+        return source
+    path = Path(source)
+    return DocumentImage(path.stem, str(source), source)
+
+
+def _render_page(pdf_path: str, page_num: int, dpi: int, grayscale: bool, return_arrays: bool):
     """
-    Convert PDF file to images (one per page).
+    Render a single PDF page in memory (runs in a worker process).
+    MuPDF is not thread-safe, so every worker opens its own document handle.
+    """
+    import fitz
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc.load_page(page_num)
+        mat = fitz.Matrix(dpi / 72, dpi / 72)
+        # Grayscale carries a third of the RGB bytes but hides stamp ink colour
+        colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+        pix = page.get_pixmap(matrix=mat, colorspace=colorspace, alpha=False)
+        
+        if return_arrays:
+            return np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+        return pix.tobytes("png")
+    finally:
+        doc.close()
+
+
+def _load_page(image):
+    """Render a PdfPage to a pixel array; other image sources pass through"""
+    if isinstance(image, PdfPage):
+        return _render_page(*image, return_arrays=True)
+    return image
+
+
+def convert_pdf_to_images(pdf_path: str, dpi: int = DEFAULT_RENDER_DPI, grayscale: bool = False,
+                          return_arrays: bool = True) -> list:
+    """
+    Convert PDF file to in-memory images (one per page).
+    
+    Pages are returned as uint8 arrays (H, W, 3) - or (H, W, 1) when grayscale -
+    or as PNG-encoded bytes when return_arrays is False. Nothing is written to disk.
     """
     if not PDF_SUPPORT:
         print(f"PDF support not available. Please install pdf2image or PyMuPDF.")
         return []
     
-    pdf_name = Path(pdf_path).stem
-    
-    # Create output directory
-    if output_dir is None:
-        output_dir = tempfile.mkdtemp(prefix="idfc_pdf_")
-    else:
-        os.makedirs(output_dir, exist_ok=True)
-    
-    image_paths = []
+    images = []
     
     try:
         # Try PyMuPDF first (faster)
         import fitz
-        doc = fitz.open(pdf_path)
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
         
-        print(f"  Converting PDF ({len(doc)} pages)...")
+        print(f"  Converting PDF ({page_count} pages)...")
         
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            # Render at 300 DPI for good quality
-            mat = fitz.Matrix(300/72, 300/72)
-            pix = page.get_pixmap(matrix=mat)
-            
-            output_path = os.path.join(output_dir, f"{pdf_name}_page_{page_num + 1}.png")
-            pix.save(output_path)
-            image_paths.append(output_path)
-            
-        doc.close()
-        print(f"  Converted {len(image_paths)} pages from PDF")
+        # Batch runs render pages lazily in their workers (load_pdf_pages) instead
+        images = [_render_page(pdf_path, n, dpi, grayscale, return_arrays) for n in range(page_count)]
+        
+        print(f"  Converted {len(images)} pages from PDF")
         
     except ImportError:
         # Fallback to pdf2image
@@ -214,14 +286,18 @@ def convert_pdf_to_images(pdf_path: str, output_dir: str = None) -> list:
             from pdf2image import convert_from_path
             
             print(f"  Converting PDF to images...")
-            images = convert_from_path(pdf_path, dpi=300)
+            pages = convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale)
             
-            for i, image in enumerate(images):
-                output_path = os.path.join(output_dir, f"{pdf_name}_page_{i + 1}.png")
-                image.save(output_path, 'PNG')
-                image_paths.append(output_path)
+            for page in pages:
+                page = page.convert('L' if grayscale else 'RGB')
+                if return_arrays:
+                    images.append(np.asarray(page))
+                else:
+                    buffer = io.BytesIO()
+                    page.save(buffer, 'PNG')
+                    images.append(buffer.getvalue())
                 
-            print(f"  Converted {len(image_paths)} pages from PDF")
+            print(f"  Converted {len(images)} pages from PDF")
             
         except Exception as e:
             print(f"Failed to convert PDF: {e}")
@@ -231,17 +307,48 @@ def convert_pdf_to_images(pdf_path: str, output_dir: str = None) -> list:
         print(f"Failed to convert PDF: {e}")
         return []
     
-    return image_paths
+    return images
+
+
+def load_pdf_pages(pdf_path: str, dpi: int = DEFAULT_RENDER_DPI, grayscale: bool = False) -> list:
+    """
+    Wrap each PDF page as a DocumentImage named <pdf>_page_<n>.
+    With PyMuPDF the pages are PdfPage references rendered by whichever worker
+    extracts them, so only one page per worker is held in memory at a time.
+    The pdf2image fallback renders everything up front as PNG bytes.
+    """
+    pdf_name = Path(pdf_path).stem
+    try:
+        import fitz
+        with fitz.open(pdf_path) as doc:
+            pages = [PdfPage(pdf_path, n, dpi, grayscale) for n in range(len(doc))]
+    except ImportError:
+        pages = convert_pdf_to_images(pdf_path, dpi=dpi, grayscale=grayscale, return_arrays=False)
+    except Exception as e:
+        print(f"Failed to open PDF: {e}")
+        return []
+    return [
+        DocumentImage(f"{pdf_name}_page_{n}", f"{pdf_path}#page={n}", image)
+        for n, image in enumerate(pages, 1)
+    ]
 
 
-def get_image_files(input_path: Path) -> list:
+def get_image_files(input_path: Path, render_dpi: int = DEFAULT_RENDER_DPI,
+                    render_gray: bool = False, sort: bool = False) -> list:
     """
     Get list of image files from input path.
+    
+    Image files are returned as paths; PDF pages are rendered in memory and
+    returned as DocumentImage entries. Folder contents keep directory order
+    unless sort is set.
     """
+    # Fast path for the common single-image call: suffix check first, one stat
+    suffix = input_path.suffix.lower()
+    if suffix in IMAGE_EXTENSIONS and input_path.is_file():
+        return [str(input_path)]
     
     if input_path.is_file():
-        # Single file mode
-        suffix = input_path.suffix.lower()
+        # Single file mode (non-image)
         
         # Handle PDF files
         if suffix == '.pdf':
@@ -249,11 +356,7 @@ def get_image_files(input_path: Path) -> list:
                 print(f"PDF support not available. Install: pip install PyMuPDF pdf2image")
                 return []
             print(f"  Detected PDF file: {input_path.name}")
-            return convert_pdf_to_images(str(input_path))
-        
-        # Handle image files
-        elif input_path.suffix in IMAGE_EXTENSIONS:
-            return [str(input_path)]
+            return load_pdf_pages(str(input_path), dpi=render_dpi, grayscale=render_gray)
         
         # Try unknown format anyway
         else:
@@ -265,131 +368,263 @@ def get_image_files(input_path: Path) -> list:
         image_paths = []
         pdf_paths = []
         
-        # Collect image files
-        for ext in IMAGE_EXTENSIONS:
-            image_paths.extend([str(p) for p in input_path.glob(f'*{ext}')])
+        # Collect image and PDF files in a single directory pass (each entry is seen once)
+        with os.scandir(input_path) as entries:
+            for entry in entries:
+                ext = os.path.splitext(entry.name)[1].lower()
+                if ext not in ALL_EXTENSIONS or not entry.is_file():
+                    continue  # is_file() uses the scandir entry type, no extra stat
+                if ext in PDF_EXTENSIONS:
+                    pdf_paths.append(entry.path)
+                else:
+                    image_paths.append(entry.path)
         
-        # Collect PDF files
-        for ext in PDF_EXTENSIONS:
-            pdf_paths.extend([str(p) for p in input_path.glob(f'*{ext}')])
+        if sort:
+            image_paths.sort()
+            pdf_paths.sort()
         
-        # Convert PDFs to images
+        # Convert PDFs to in-memory page images
         if pdf_paths:
             print(f"  Found {len(pdf_paths)} PDF file(s) - converting...")
             for pdf_path in pdf_paths:
-                converted = convert_pdf_to_images(pdf_path)
-                image_paths.extend(converted)
+                image_paths.extend(load_pdf_pages(pdf_path, dpi=render_dpi, grayscale=render_gray))
         
-        return sorted(set(image_paths))
+        return image_paths
     
     else:
         return []
 
 
-def create_extractor(method: str):
-    """Create appropriate extractor based on method"""
+def create_extractor(method: str, use_cache: bool = True):
+    """Get the (per-process cached) extractor for the method (use_cache: hybrid result cache)"""
     if method == 'gemini':
-        key_manager = RoundRobinKeyManager(API_KEYS)
-        extractor = GeminiExtractor(key_manager)
+        extractor = get_gemini_extractor()
         if not extractor.initialized:
             print("⚠️  Gemini not available, falling back to hybrid mode")
-            return HybridExtractor()
+            return get_hybrid_extractor(use_cache)
         return extractor
     
     elif method == 'ocr':
-        extractor = EasyOCRExtractor()
+        extractor = get_easyocr_extractor()
         if not extractor.initialized:
             print("❌ EasyOCR not available")
             return None
         return extractor
     
     else:  # hybrid (default)
-        return HybridExtractor()
+        return get_hybrid_extractor(use_cache)
 
 
-def process_single_file(extractor, image_path: str, method: str) -> dict:
-    """Process a single invoice file and return formatted result"""
+def process_single_file(extractor, image_source, method: str, timestamp: str = None) -> dict:
+    """
+    Process a single invoice (file path or in-memory DocumentImage) and return formatted result.
+    Batch runs pass one shared timestamp instead of formatting the clock per document.
+    """
+    doc_id, source_file, image = _source_info(image_source)
+    image = _load_page(image)
+    if timestamp is None:
+        timestamp = datetime.now().isoformat()
     if method in ['gemini', 'ocr']:
         # Direct extractor returns raw result
-        result = extractor.extract(image_path)
-        doc_id = Path(image_path).stem
+        result = extractor.extract(image)
         
-        return {
-            "doc_id": doc_id,
-            "source_file": str(image_path),
-            "fields": {
-                "dealer_name": result.get('dealer_name') if result else None,
-                "model_name": result.get('model_name') if result else None,
-                "horse_power": result.get('horse_power') if result else None,
-                "asset_cost": result.get('asset_cost') if result else None,
-                "signature": {
-                    "present": result.get('signature_present', False) if result else False,
-                    "bbox": result.get('signature_bbox') if result else None
-                },
-                "stamp": {
-                    "present": result.get('stamp_present', False) if result else False,
-                    "bbox": result.get('stamp_bbox') if result else None
-                }
-            },
-            "confidence": result.get('confidence', 0) if result else 0,
-            "processing_time_sec": result.get('processing_time_sec', 0) if result else 0,
-            "cost_estimate_usd": 0.0003 if result and result.get('extraction_method') == 'gemini' else 0.0,
-            "extraction_method": result.get('extraction_method', 'unknown') if result else 'failed',
-            "timestamp": datetime.now().isoformat()
-        }
+        method_used = result.get('extraction_method', 'unknown') if result else 'failed'
+        elapsed = result.get('processing_time_sec', 0) if result else 0
+        output = ExtractResult.from_raw(doc_id, result, method_used, elapsed).to_dict()
+        output["source_file"] = source_file
+        output["timestamp"] = timestamp
+        return output
     else:
         # Hybrid extractor returns formatted result
-        result = extractor.extract(image_path)
-        result["source_file"] = str(image_path)
-        result["timestamp"] = datetime.now().isoformat()
+        result = extractor.extract(image, doc_id=doc_id)
+        result["source_file"] = source_file
+        result["timestamp"] = timestamp
         return result
 
 
-def process_batch_files(extractor, image_paths: list, output_path: str, method: str) -> list:
-    """Process multiple invoice files with progress tracking"""
-    results = []
+# Extractor owned by a batch worker process (built once by _worker_init)
+_worker_extractor = None
+
+
+def _worker_init(method: str, use_cache: bool = True):
+    """Build the extractor once per worker process (model state is not picklable);
+    every task submitted to the worker then reuses it"""
+    global _worker_extractor
+    _worker_extractor = create_extractor(method, use_cache)
+
+
+def _worker_process(image_source, method: str, timestamp: str) -> dict:
+    """Process a single file with the extractor of the current worker process"""
+    if _worker_extractor is None:
+        raise RuntimeError(f"{method} extractor not available in worker")
+    return process_single_file(_worker_extractor, image_source, method, timestamp)
+
+
+def _failed_result(doc_id: str, source_file: str, error: Exception, timestamp: str) -> dict:
+    """Build the result entry for a document that raised during processing"""
+    return {
+        "doc_id": doc_id,
+        "source_file": source_file,
+        "error": str(error),
+        "confidence": 0,
+        "extraction_method": "failed",
+        "timestamp": timestamp
+    }
+
+
+def _status_text(result: dict) -> str:
+    """Status suffix of a processed document line"""
+    if "error" in result:
+        return f"[FAIL] Failed: {result['error'][:30]}"
+    conf = result.get('confidence', 0)
+    status = "[OK]" if conf > 0.5 else "[WARN]" if conf > 0 else "[FAIL]"
+    return f"{status} Done (Confidence: {conf:.0%})"
+
+
+def _make_progress_bar(total: int, quiet: bool):
+    """tqdm progress bar for batch runs, or None when tqdm is not installed"""
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        return None
+    return tqdm(total=total, desc="  Processing", unit="doc", disable=quiet)
+
+
+def _report_progress(pbar, done: int, total: int, doc: "DocumentImage", result: dict, quiet: bool):
+    """Advance the progress bar, or print one status line per document"""
+    if pbar is not None:
+        pbar.update(1)
+        if "error" in result and not quiet:
+            pbar.write("  {}: {}".format(os.path.basename(doc.source_file)[:30], _status_text(result)))
+    elif not quiet:
+        print("  [{}/{}] {}... {}".format(done, total, os.path.basename(doc.source_file)[:30],
+                                          _status_text(result)))
+
+
+def _prefetch_files(indexed_docs: list, out_queue: queue.Queue):
+    """Read upcoming files into memory while the current document is being extracted"""
+    for i, doc in indexed_docs:
+        if isinstance(doc.image, (str, os.PathLike)):
+            try:
+                with open(doc.image, 'rb') as f:
+                    doc = doc._replace(image=f.read())
+            except OSError:
+                pass  # Let the extractor report the unreadable path
+        elif isinstance(doc.image, PdfPage):
+            try:
+                doc = doc._replace(image=_load_page(doc.image))
+            except Exception:
+                pass  # Rendered (and reported) again by process_single_file
+        out_queue.put((i, doc))
+
+
+def process_batch_files(extractor, image_paths: list, output_path: str, method: str,
+                        workers: int = 1, quiet: bool = False, use_cache: bool = True) -> list:
+    """
+    Process multiple invoice files with progress tracking.
+
+    With workers > 1 documents are processed concurrently: Gemini (network-bound)
+    shares one extractor across threads, while OCR/LLM work (CPU-bound) runs in
+    worker processes that each build their own extractor.
+
+    Each result is appended to `<output_path>.jsonl` as soon as it completes.
+    If that file already exists, documents it holds are not processed again.
+    """
+    results = [None] * len(image_paths)
     total = len(image_paths)
+    sink_path = output_path + ".jsonl"
     
-    print("\n+" + "-" * 68 + "+")
+    print("\n" + _BOX_RULE)
     print("|" + " BATCH PROCESSING ".center(68) + "|")
-    print("+" + "-" * 68 + "+\n")
+    print(_BOX_RULE + "\n")
     
-    for i, path in enumerate(image_paths, 1):
-        doc_name = Path(path).name[:30]
-        progress = f"[{i}/{total}]"
-        print(f"  {progress} Processing: {doc_name}...", end=" ", flush=True)
-        
-        try:
-            result = process_single_file(extractor, path, method)
-            results.append(result)
-            conf = result.get('confidence', 0)
-            status = "[OK]" if conf > 0.5 else "[WARN]" if conf > 0 else "[FAIL]"
-            print(f"{status} Done (Confidence: {conf:.0%})")
-        except Exception as e:
-            print(f"[FAIL] Failed: {str(e)[:30]}")
-            results.append({
-                "doc_id": Path(path).stem,
-                "source_file": str(path),
-                "error": str(e),
-                "confidence": 0,
-                "extraction_method": "failed",
-                "timestamp": datetime.now().isoformat()
-            })
+    # One timestamp for the whole batch (per-document clock reads add nothing useful)
+    batch_timestamp = datetime.now().isoformat()
+    
+    # Resolve doc ids / display names once per document
+    docs = [_source_info(source) for source in image_paths]
+    
+    # Resume from a previous run
+    completed = load_completed(sink_path)
+    pending = []
+    for i, doc in enumerate(docs):
+        if doc.doc_id in completed:
+            results[i] = completed[doc.doc_id]
+        else:
+            pending.append(i)
+    if len(pending) < total:
+        print(f"  Resuming: {total - len(pending)} document(s) already in {sink_path}\n")
+    remaining = len(pending)
+    pbar = _make_progress_bar(remaining, quiet)
+    
+    # Each record is flushed as it is written, so a killed run loses none of them
+    with open(sink_path, 'ab', buffering=1 << 16) as sink:
+        if workers > 1:
+            if isinstance(extractor, GeminiExtractor):
+                executor = ThreadPoolExecutor(max_workers=workers)
+                
+                def submit(doc):
+                    # MuPDF is not thread-safe: render PDF pages here, not in the pool threads
+                    try:
+                        doc = doc._replace(image=_load_page(doc.image))
+                    except Exception as e:
+                        failed = Future()
+                        failed.set_exception(e)
+                        return failed
+                    return executor.submit(process_single_file, extractor, doc, method,
+                                           batch_timestamp)
+            else:
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=_worker_init,
+                                               initargs=(method, use_cache))
+                submit = lambda p: executor.submit(_worker_process, p, method, batch_timestamp)
+            
+            with executor:
+                completions = bounded_completion(lambda i: submit(docs[i]), pending,
+                                                  workers * MAX_IN_FLIGHT_PER_WORKER)
+                for done, (i, future) in enumerate(completions, 1):
+                    doc = docs[i]
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        results[i] = _failed_result(doc.doc_id, doc.source_file, e,
+                                                    batch_timestamp)
+                    sink.write(_json.dumps(results[i]) + b"\n")
+                    sink.flush()
+                    _report_progress(pbar, done, remaining, doc, results[i], quiet)
+        else:
+            # Prefetch the next file from disk while the current one is extracted
+            prefetched = queue.Queue(maxsize=2)
+            threading.Thread(target=_prefetch_files, daemon=True,
+                             args=([(i, docs[i]) for i in pending], prefetched)).start()
+            
+            for done in range(1, remaining + 1):
+                i, doc = prefetched.get()
+                try:
+                    results[i] = process_single_file(extractor, doc, method, batch_timestamp)
+                except Exception as e:
+                    results[i] = _failed_result(doc.doc_id, doc.source_file, e, batch_timestamp)
+                sink.write(_json.dumps(results[i]) + b"\n")
+                sink.flush()
+                _report_progress(pbar, done, remaining, doc, results[i], quiet)
+    
+    if pbar is not None:
+        pbar.close()
     
     # Save results
+    successful = summarize_results(results)[0]
     batch_output = {
         "batch_info": {
             "total_documents": total,
-            "successful": sum(1 for r in results if r.get('confidence', 0) > 0),
-            "failed": sum(1 for r in results if r.get('confidence', 0) == 0),
+            "successful": successful,
+            "failed": total - successful,
             "extraction_method": method,
             "processed_at": datetime.now().isoformat()
         },
         "documents": results
     }
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(batch_output, f, indent=2, ensure_ascii=False)
+    _json.dump_file(batch_output, output_path)
+    os.remove(sink_path)  # Complete; a later run on this path starts fresh
     
     return results
 
@@ -410,6 +645,7 @@ Examples:
   Batch folder:  python main.py -i train/ -o results.json
   Gemini only:   python main.py -i invoice.png -o result.json --method gemini
   OCR only:      python main.py -i invoice.png -o result.json --method ocr
+  Parallel:      python main.py -i train/ -o results.json --workers 8
         """
     )
     parser.add_argument('-i', '--input', required=True, 
@@ -418,6 +654,18 @@ Examples:
                         help='Output JSON file path')
     parser.add_argument('--method', choices=['hybrid', 'gemini', 'ocr'], default='hybrid',
                         help='Extraction method: hybrid (default), gemini, or ocr')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Parallel workers for batch processing (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--render-dpi', type=int, default=DEFAULT_RENDER_DPI,
+                        help=f'Resolution for rendering PDF pages (default: {DEFAULT_RENDER_DPI})')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Suppress per-document progress and result lines in batch mode')
+    parser.add_argument('--sort', action='store_true',
+                        help='Process folder contents in sorted order (default: directory order)')
+    parser.add_argument('--render-gray', action='store_true',
+                        help='Render PDF pages in grayscale (faster, but disables colour stamp detection)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not read or write the persistent result cache (~/.idfc_cache)')
     
     args = parser.parse_args()
     
@@ -426,7 +674,8 @@ Examples:
     
     # Get image files
     input_path = Path(args.input)
-    image_paths = get_image_files(input_path)
+    image_paths = get_image_files(input_path, render_dpi=args.render_dpi,
+                                  render_gray=args.render_gray, sort=args.sort)
     
     if not image_paths:
         print(f"\n❌ Error: No valid files found at '{args.input}'")
@@ -443,9 +692,15 @@ Examples:
     print_config(args.method, args.input, args.output, len(image_paths))
     print(f"\n  > Mode: {mode}")
     
-    # Create extractor
-    extractor = create_extractor(args.method)
-    if extractor is None:
+    # Create extractor (batch worker processes build their own)
+    use_process_pool = not is_single_file and args.workers > 1 and args.method != 'gemini'
+    use_cache = not args.no_cache
+    extractor = None if use_process_pool else create_extractor(args.method, use_cache)
+    if extractor is None and not use_process_pool:
+        return 1
+    if use_process_pool and args.method == 'ocr' and importlib.util.find_spec("easyocr") is None:
+        # Checked here: workers would otherwise record every document as failed
+        print("❌ EasyOCR not available")
         return 1
     
     # Process based on mode
@@ -457,8 +712,7 @@ Examples:
         output = process_single_file(extractor, image_paths[0], args.method)
         
         # Save result
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(output, f, indent=2, ensure_ascii=False)
+        _json.dump_file(output, args.output)
         
         # Print formatted result
         print_single_result(output)
@@ -467,10 +721,12 @@ Examples:
         # ═══════════════════════════════════════════════════════════════════
         #                        BATCH FOLDER MODE
         # ═══════════════════════════════════════════════════════════════════
-        results = process_batch_files(extractor, image_paths, args.output, args.method)
+        results = process_batch_files(extractor, image_paths, args.output, args.method,
+                                      workers=args.workers, quiet=args.quiet,
+                                      use_cache=use_cache)
         
         # Print batch summary
-        print_batch_summary(results, args.output)
+        print_batch_summary(results, args.output, details=not args.quiet)
     
     # Print footer
     print_footer(args.output)
@@ -0,0 +1,53 @@
+
+"""JSON helpers: orjson (C implementation) when installed, standard library otherwise"""
+
+import os
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Integer / non-string dict keys are written as strings, like the standard library does
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except clause fits both
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    """Parse JSON from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes (non-ASCII characters kept as-is)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def dump_file(obj, output_path: str):
+    """
+    Write indented UTF-8 JSON to a file (streamed chunk by chunk without orjson).
+    The data goes to a temporary file that then replaces output_path in one
+    step, so readers never see a partially written file.
+    """
+    tmp_path = f"{output_path}.tmp"
+    try:
+        if orjson is not None:
+            data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 | _ORJSON_OPTIONS)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for chunk in json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(obj):
+                    f.write(chunk)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
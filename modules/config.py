@@ -1,3 +1,4 @@
+import os
 
 # API KEY MANAGEMENT
 # ============================================================================
@@ -10,3 +11,12 @@ GEMINI_MODEL = "gemini-1.5-flash"
 
 # Empty keys list forces offline mode immediately
 API_KEYS = []
+
+
+# RESULT CACHE
+# ============================================================================
+
+# Extraction results are cached by image content hash so re-runs are instant
+# (in the user's home directory, shared by runs from any working directory)
+# SQLite in WAL mode: batch worker processes share it concurrently
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".idfc_cache", "results.sqlite")
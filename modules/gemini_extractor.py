@@ -1,146 +1,311 @@
 
 import logging
-import base64
 import io
-import json
+import re
 import time
-from typing import Optional, Dict, Any
+import copy
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+import cv2
+import numpy as np
 from PIL import Image
 
-try:
-    from google import genai
-    from google.genai import types
-except ImportError:
-    pass
-
+from . import _json
 from .config import GEMINI_MODEL
 from .key_manager import RoundRobinKeyManager
 
 logger = logging.getLogger(__name__)
 
+# Response parsing: fenced code block, and the outermost JSON object / array
+_CODEBLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)```')
+_JSON_OBJ_RE = re.compile(r'\{[\s\S]*\}')
+_JSON_ARRAY_RE = re.compile(r'\[[\s\S]*\]')
+
+# Longest side of uploaded images (larger images are downscaled to reduce API cost)
+MAX_IMAGE_SIZE = 1024
+
+# Upload encoding (JPEG is far smaller and cheaper to encode than PNG for scans/photos)
+JPEG_QUALITY = 85
+
+# Responses kept in memory, keyed by the uploaded image bytes (duplicate scans skip the API)
+RESPONSE_CACHE_SIZE = 256
+
+# Idle connections kept open by the HTTP client shared across API keys
+HTTP_KEEPALIVE_CONNECTIONS = 8
+
+# Images sent together in one extract_batch request
+GEMINI_BATCH_SIZE = 4
+
+# Single comprehensive prompt for all fields
+EXTRACTION_PROMPT = """Analyze this Indian tractor loan quotation invoice and extract ALL fields.
+
+EXTRACT THESE FIELDS:
+1. dealer_name: Business name of dealer/seller (from letterhead)
+2. model_name: Tractor model - ONLY brand + number (e.g., "Mahindra 575 DI", "Swaraj 744"). Keep SHORT!
+3. horse_power: HP value as number only (e.g., "50")
+4. asset_cost: Total price in INR as number (no commas, e.g., 850000)
+5. signature_present: true/false - is there a handwritten signature?
+6. signature_bbox: [x1,y1,x2,y2] as % of image (0-100), or null
+7. stamp_present: true/false - is there an official stamp/seal?
+8. stamp_bbox: [x1,y1,x2,y2] as % of image (0-100), or null
+
+Return ONLY JSON (no markdown, no explanation):
+{"dealer_name":"string or null","model_name":"string or null","horse_power":"string or null","asset_cost":number or null,"signature_present":true/false,"signature_bbox":[x1,y1,x2,y2] or null,"stamp_present":true/false,"stamp_bbox":[x1,y1,x2,y2] or null,"confidence":0.0-1.0}"""
+
+# Preamble for multi-image requests (followed by EXTRACTION_PROMPT)
+BATCH_PROMPT = """You are given {count} separate invoice images. Apply the instructions below to EACH image independently.
+Return ONLY a JSON array with exactly one object per image, in the same order as the images: [{{...}}, {{...}}]
+
+"""
+
+
+def _open_image(image_source: Any) -> "Image.Image":
+    """Open a file path, encoded image bytes or an RGB/grayscale array with PIL"""
+    if isinstance(image_source, np.ndarray):
+        if image_source.ndim == 3 and image_source.shape[2] == 1:
+            image_source = image_source[:, :, 0]
+        return Image.fromarray(image_source)
+    if isinstance(image_source, (bytes, bytearray)):
+        return Image.open(io.BytesIO(image_source))
+    return Image.open(image_source)
+
+
+def _shared_http_options(types) -> Optional[Any]:
+    """
+    HttpOptions carrying one pooled httpx client (HTTP/2 when the h2 package is
+    installed) for every API key's Client, so requests reuse open connections.
+    None when httpx or this google-genai version does not support it.
+    """
+    try:
+        import httpx
+        http2 = importlib.util.find_spec("h2") is not None
+        http_client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS))
+        return types.HttpOptions(httpx_client=http_client)
+    except Exception as e:
+        logger.info(f"Shared HTTP client unavailable, using per-client connections: {e}")
+        return None
+
+
 class GeminiExtractor:
     """Gemini-based document extractor"""
     
+    __slots__ = ('key_manager', 'initialized', 'genai', 'types', '_http_options',
+                 '_responses', '_responses_lock', '_clients', '_clients_lock')
+    
     def __init__(self, key_manager: RoundRobinKeyManager):
         self.key_manager = key_manager
         self.initialized = False
+        self._responses = OrderedDict()  # image digest -> parsed result (LRU order)
+        self._responses_lock = threading.Lock()
+        self._clients = {}  # API key -> Client (keeps its connection pool warm)
+        self._clients_lock = threading.Lock()
         try:
+            # Imported on first construction: google-genai is slow to import
+            from google import genai
+            from google.genai import types
             self.genai = genai
             self.types = types
+            self._http_options = _shared_http_options(types)
             self.initialized = True
             logger.info("Gemini extractor initialized")
         except ImportError:
             logger.warning("google-genai not installed. Gemini extraction disabled.")
-        except NameError:
-             logger.warning("google-genai not imported. Gemini extraction disabled.")
 
     
-    def extract(self, image_path: str) -> Optional[Dict[str, Any]]:
-        """Extract fields using Gemini Vision API"""
-        if not self.initialized:
-            return None
+    def _prepare_image(self, image_source: Any):
+        """Load, resize and JPEG-encode an image; returns (jpeg_bytes, (width, height))"""
+        img = _open_image(image_source)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        arr = np.asarray(img)
+        h, w = arr.shape[:2]
         
+        # Resize to reduce API costs (area averaging: fast and clean for downscaling)
+        max_dim = w if w > h else h
+        if max_dim > MAX_IMAGE_SIZE:
+            ratio = MAX_IMAGE_SIZE / max_dim
+            w, h = int(w * ratio), int(h * ratio)
+            arr = cv2.resize(arr, (w, h), interpolation=cv2.INTER_AREA)
+        
+        ok, buffer = cv2.imencode(".jpg", cv2.cvtColor(arr, cv2.COLOR_RGB2BGR),
+                                  [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return buffer.tobytes(), (w, h)
+    
+    def _client(self, api_key: str):
+        """Client for an API key, created on first use and reused afterwards"""
+        client = self._clients.get(api_key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(api_key)
+                if client is None:
+                    if self._http_options is not None:
+                        client = self.genai.Client(api_key=api_key, http_options=self._http_options)
+                    else:
+                        client = self.genai.Client(api_key=api_key)
+                    self._clients[api_key] = client
+        return client
+    
+    def _generate(self, prompt: str, images: List[bytes]) -> str:
+        """One generate_content call with the prompt followed by the images; returns the response text"""
+        types = self.types
+        part_from_bytes = types.Part.from_bytes
+        api_key = self.key_manager.get_key()
+        client = self._client(api_key)
+        parts = [types.Part.from_text(text=prompt)]
+        parts.extend(part_from_bytes(data=data, mime_type="image/jpeg") for data in images)
         try:
-            # Load and prepare image
-            img = Image.open(image_path)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize to reduce API costs
-            max_size = 1024
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            img.save(buffer, format="PNG")
-            image_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            # Get API key (round-robin)
-            api_key = self.key_manager.get_key()
-            client = self.genai.Client(api_key=api_key)
-            
-            # Single comprehensive prompt for all fields
-            prompt = """Analyze this Indian tractor loan quotation invoice and extract ALL fields.
-
-EXTRACT THESE FIELDS:
-1. dealer_name: Business name of dealer/seller (from letterhead)
-2. model_name: Tractor model - ONLY brand + number (e.g., "Mahindra 575 DI", "Swaraj 744"). Keep SHORT!
-3. horse_power: HP value as number only (e.g., "50")
-4. asset_cost: Total price in INR as number (no commas, e.g., 850000)
-5. signature_present: true/false - is there a handwritten signature?
-6. signature_bbox: [x1,y1,x2,y2] as % of image (0-100), or null
-7. stamp_present: true/false - is there an official stamp/seal?
-8. stamp_bbox: [x1,y1,x2,y2] as % of image (0-100), or null
-
-Return ONLY JSON (no markdown, no explanation):
-{"dealer_name":"string or null","model_name":"string or null","horse_power":"string or null","asset_cost":number or null,"signature_present":true/false,"signature_bbox":[x1,y1,x2,y2] or null,"stamp_present":true/false,"stamp_bbox":[x1,y1,x2,y2] or null,"confidence":0.0-1.0}"""
-            
             response = client.models.generate_content(
                 model=GEMINI_MODEL,
-                contents=[
-                    self.types.Content(
-                        role="user",
-                        parts=[
-                            self.types.Part.from_text(text=prompt),
-                            self.types.Part.from_bytes(
-                                data=base64.b64decode(image_base64),
-                                mime_type="image/png"
-                            )
-                        ]
-                    )
-                ]
+                contents=[types.Content(role="user", parts=parts)]
             )
+        except Exception as e:
+            error_str = str(e)
+            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                self.key_manager.mark_rate_limited(api_key)
+            raise
+        return response.text.strip() if response.text else ""
+    
+    @staticmethod
+    def _parse_json(raw_text: str, payload_re: "re.Pattern" = _JSON_OBJ_RE) -> Any:
+        """Parse the JSON payload of a response, tolerating markdown fences and surrounding prose"""
+        # Remove markdown code blocks if present
+        if "```" in raw_text:
+            json_match = _CODEBLOCK_RE.search(raw_text)
+            if json_match:
+                raw_text = json_match.group(1).strip()
+        
+        # Try to find the JSON payload in text
+        if not raw_text.startswith(("{", "[")):
+            json_match = payload_re.search(raw_text)
+            if json_match:
+                raw_text = json_match.group(0)
+        
+        return _json.loads(raw_text.strip())
+    
+    @staticmethod
+    def _finish(result: Dict[str, Any], size) -> Dict[str, Any]:
+        """Convert bbox percentages to pixels and tag the result"""
+        sx, sy = size[0] / 100.0, size[1] / 100.0
+        for field in ('signature_bbox', 'stamp_bbox'):
+            bbox = result.get(field)
+            if bbox:
+                result[field] = [int(bbox[0] * sx), int(bbox[1] * sy),
+                                 int(bbox[2] * sx), int(bbox[3] * sy)]
+        
+        result['extraction_method'] = 'gemini'
+        return result
+    
+    def _cached_response(self, image_data: bytes):
+        """Copy of the result cached for these image bytes (None on a miss), and the cache key"""
+        key = hashlib.blake2b(image_data, digest_size=16).digest()
+        with self._responses_lock:
+            result = self._responses.get(key)
+            if result is None:
+                return None, key
+            self._responses.move_to_end(key)
+        result = copy.deepcopy(result)
+        result['extraction_method'] = 'gemini_cached'
+        return result, key
+    
+    def _store_response(self, key: bytes, result: Dict[str, Any]):
+        """Remember a parsed result, evicting the least recently used beyond RESPONSE_CACHE_SIZE"""
+        with self._responses_lock:
+            self._responses[key] = copy.deepcopy(result)
+            if len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+    
+    def extract(self, image_source: Any) -> Optional[Dict[str, Any]]:
+        """Extract fields using Gemini Vision API (path, image bytes or array)"""
+        if not self.initialized:
+            return None
+        
+        try:
+            image_data, size = self._prepare_image(image_source)
+            cached, key = self._cached_response(image_data)
+            if cached is not None:
+                return cached
             
             # Parse response with robust JSON extraction
-            raw_text = response.text.strip() if response.text else ""
-            
+            raw_text = self._generate(EXTRACTION_PROMPT, [image_data])
             if not raw_text:
                 logger.warning("Empty response from Gemini")
                 return None
             
-            # Remove markdown code blocks if present
-            if "```" in raw_text:
-                import re
-                json_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', raw_text)
-                if json_match:
-                    raw_text = json_match.group(1).strip()
-            
-            # Try to find JSON object in text
-            if not raw_text.startswith("{"):
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', raw_text)
-                if json_match:
-                    raw_text = json_match.group(0)
-            
-            # Clean any trailing/leading whitespace
-            raw_text = raw_text.strip()
+            result = self._finish(self._parse_json(raw_text), size)
+            self._store_response(key, result)
+            return result
             
-            result = json.loads(raw_text)
+        except Exception as e:
+            logger.warning(f"Gemini extraction failed: {e}")
+            return None
+    
+    def extract_batch(self, image_sources: List[Any], k: int = GEMINI_BATCH_SIZE) -> List[Optional[Dict[str, Any]]]:
+        """
+        Extract fields for several images, sending up to k images per request.
+        
+        Results are returned in input order (None where extraction failed). Images
+        seen before are answered from the response cache. A group
+        whose combined response cannot be matched to its images is retried one
+        image at a time; a group whose request failed (e.g. rate limited) is left
+        as None rather than turned into k more requests.
+        """
+        if not self.initialized:
+            return [None] * len(image_sources)
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(image_sources)
+        for start in range(0, len(image_sources), k):
+            group = image_sources[start:start + k]
+            if len(group) == 1:
+                results[start] = self.extract(group[0])
+                continue
             
-            # Convert bbox percentages to pixels
-            img_w, img_h = img.size
-            if result.get('signature_bbox'):
-                bbox = result['signature_bbox']
-                result['signature_bbox'] = [
-                    int(bbox[0] * img_w / 100), int(bbox[1] * img_h / 100),
-                    int(bbox[2] * img_w / 100), int(bbox[3] * img_h / 100)
-                ]
-            if result.get('stamp_bbox'):
-                bbox = result['stamp_bbox']
-                result['stamp_bbox'] = [
-                    int(bbox[0] * img_w / 100), int(bbox[1] * img_h / 100),
-                    int(bbox[2] * img_w / 100), int(bbox[3] * img_h / 100)
-                ]
+            # Decode / resize / encode the group's images concurrently
+            with ThreadPoolExecutor(max_workers=len(group)) as pool:
+                prepared = list(pool.map(self._prepare_safely, group))
+            ready, keys = [], {}
+            for i, item in enumerate(prepared):
+                if item is None:
+                    continue
+                cached, keys[i] = self._cached_response(item[0])
+                if cached is not None:
+                    results[start + i] = cached
+                else:
+                    ready.append(i)
+            if not ready:
+                continue
             
-            result['extraction_method'] = 'gemini'
-            return result
+            try:
+                raw_text = self._generate(BATCH_PROMPT.format(count=len(ready)) + EXTRACTION_PROMPT,
+                                          [prepared[i][0] for i in ready])
+                parsed = self._parse_json(raw_text, _JSON_ARRAY_RE) if raw_text else None
+            except Exception as e:
+                logger.warning(f"Gemini batch extraction failed: {e}")
+                continue
             
+            if isinstance(parsed, list) and len(parsed) == len(ready):
+                for i, result in zip(ready, parsed):
+                    if isinstance(result, dict):
+                        results[start + i] = self._finish(result, prepared[i][1])
+                        self._store_response(keys[i], results[start + i])
+            else:
+                logger.warning("Gemini batch response did not match its images; retrying individually")
+                for i in ready:
+                    results[start + i] = self.extract(group[i])
+        
+        return results
+    
+    def _prepare_safely(self, image_source: Any):
+        """_prepare_image, or None for an unreadable image"""
+        try:
+            return self._prepare_image(image_source)
         except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                self.key_manager.mark_rate_limited(api_key)
-            logger.warning(f"Gemini extraction failed: {e}")
+            logger.warning(f"Gemini could not load image: {e}")
             return None
@@ -1,21 +1,98 @@
 
 import logging
 import time
-import json
+import hashlib
+import os
+import sqlite3
+import multiprocessing
+import importlib.util
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from .config import API_KEYS
+import numpy as np
+
+from . import _json
+from .config import API_KEYS, CACHE_PATH
+from .result import ExtractResult, load_completed
+from .pool import bounded_completion, MAX_IN_FLIGHT_PER_WORKER
 from .key_manager import RoundRobinKeyManager
-from .gemini_extractor import GeminiExtractor
-from .ocr_extractor import EasyOCRExtractor
-from .local_llm_extractor import LocalLLMExtractor
+from .gemini_extractor import GeminiExtractor, GEMINI_BATCH_SIZE
+from .ocr_extractor import EasyOCRExtractor, OCR_BATCH_SIZE
+from .local_llm_extractor import LocalLLMExtractor, DEFAULT_MODEL_PATH, LLM_FIELDS
 
 logger = logging.getLogger(__name__)
 
-# Global key manager
-key_manager = RoundRobinKeyManager(API_KEYS)
+
+# Consecutive Gemini failures before Gemini is skipped for the rest of the run
+GEMINI_FAIL_THRESHOLD = 5
+
+# Summary separator (built once)
+_SUMMARY_RULE = '═' * 50
+
+# Worker processes for process_batch (each loads its own OCR models)
+DEFAULT_BATCH_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Read size for hashing images (large sequential reads, flat memory)
+HASH_CHUNK_SIZE = 1 << 20
+
+# Default for extract()'s pre-fetched engine results: nothing was attempted yet
+# (None means the engine was already tried for this document and failed)
+_NOT_FETCHED = object()
+
+
+# ───────────────────────────────────────────────────────────────────────────
+# Per-process singletons: clients and models are built once and shared by
+# every extractor (and every task of a batch worker process)
+# ───────────────────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=None)
+def get_key_manager() -> RoundRobinKeyManager:
+    """Shared API key manager"""
+    return RoundRobinKeyManager(API_KEYS)
+
+
+@lru_cache(maxsize=None)
+def get_gemini_extractor() -> GeminiExtractor:
+    """Shared Gemini extractor"""
+    return GeminiExtractor(get_key_manager())
+
+
+@lru_cache(maxsize=None)
+def get_easyocr_extractor() -> EasyOCRExtractor:
+    """Shared EasyOCR extractor (loads the OCR models once)"""
+    return EasyOCRExtractor()
+
+
+@lru_cache(maxsize=None)
+def get_local_llm_extractor(model_path: str = DEFAULT_MODEL_PATH) -> LocalLLMExtractor:
+    """Shared local LLM extractor (loads the GGUF model once)"""
+    return LocalLLMExtractor(model_path)
+
+
+@lru_cache(maxsize=None)
+def get_hybrid_extractor(use_cache: bool = True) -> "HybridExtractor":
+    """Shared hybrid extractor"""
+    return HybridExtractor(use_cache=use_cache)
+
+
+def _read_files(paths: List[str]) -> List[Any]:
+    """Read files into memory (an unreadable path is kept as-is for the extractor to report)"""
+    contents = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                contents.append(f.read())
+        except OSError:
+            contents.append(path)
+    return contents
+
+
+def _extract_group_in_worker(paths: List[str], use_cache: bool) -> List[Any]:
+    """Batch worker task: extract a group with the worker process's shared hybrid extractor"""
+    return get_hybrid_extractor(use_cache).extract_group(paths)
 
 
 class HybridExtractor:
@@ -26,53 +103,176 @@ class HybridExtractor:
     
     Features:
         - Automatic failover: If Gemini fails, falls back to EasyOCR
+        - Circuit breaker: Gemini is disabled after repeated consecutive failures
         - Offline Intelligence: Uses Local LLM to parse OCR text
         - Processing time tracking for each document
         - Cost estimation for API usage
         - Structured output format with confidence scores
+        - Persistent result cache keyed by image content hash
     """
     
-    def __init__(self):
-        """Initialize hybrid extractor with all engines"""
-        self.gemini = GeminiExtractor(key_manager)
-        self.easyocr = EasyOCRExtractor()
-        self.local_llm = LocalLLMExtractor()
+    def __init__(self, use_cache: bool = True):
+        """Initialize hybrid extractor with all engines (use_cache=False disables the result cache)"""
+        # Gemini is only built when a usable API key is configured (checked once, not per document)
+        has_keys = any(k.startswith("AI") for k in API_KEYS)
+        self.gemini = get_gemini_extractor() if has_keys else None
+        
+        # Offline engines load their models on first use (seconds of startup
+        # that a Gemini-served or fully cached run never needs)
+        self._easyocr = None
+        self._local_llm = None
+        
+        # Status tracking (offline engines: installed now, confirmed when loaded)
+        self.gemini_available = has_keys and self.gemini.initialized
+        self.easyocr_available = importlib.util.find_spec("easyocr") is not None
+        self.local_llm_available = (os.path.exists(DEFAULT_MODEL_PATH)
+                                    and importlib.util.find_spec("llama_cpp") is not None)
         
-        # Status tracking
-        self.gemini_available = self.gemini.initialized
-        self.easyocr_available = self.easyocr.initialized
-        self.local_llm_available = self.local_llm.initialized
+        # Circuit breaker for Gemini (e.g. exhausted quota on every key)
+        self._gemini_fail_streak = 0
+        self._gemini_fail_threshold = GEMINI_FAIL_THRESHOLD
         
         logger.info(f"Hybrid Engine | Gemini: {self.gemini_available} | EasyOCR: {self.easyocr_available} | LocalLLM: {self.local_llm_available}")
+        
+        # Result cache (engine set is part of the key so upgrades are not masked)
+        self.use_cache = use_cache
+        self._cache = None
+        if use_cache:
+            self._open_cache()
+    
+    def _open_cache(self):
+        """Open (creating if needed) the persistent result cache"""
+        try:
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            self._cache = sqlite3.connect(CACHE_PATH, isolation_level=None,
+                                          check_same_thread=False, timeout=30)
+            self._cache.execute("PRAGMA journal_mode=WAL")
+            self._cache.execute("CREATE TABLE IF NOT EXISTS cache(k TEXT PRIMARY KEY, v BLOB)")
+        except (sqlite3.Error, OSError) as e:
+            self._cache = None
+            logger.warning(f"⚠️ Result cache unavailable ({CACHE_PATH}): {e}")
+    
+    @property
+    def easyocr(self) -> EasyOCRExtractor:
+        """EasyOCR extractor, loaded on first use"""
+        if self._easyocr is None:
+            self._easyocr = get_easyocr_extractor()
+            self.easyocr_available = self._easyocr.initialized
+        return self._easyocr
     
-    def extract(self, image_path: str) -> Dict[str, Any]:
+    @property
+    def local_llm(self) -> LocalLLMExtractor:
+        """Local LLM extractor, loaded on first use"""
+        if self._local_llm is None:
+            self._local_llm = get_local_llm_extractor()
+            self.local_llm_available = self._local_llm.initialized
+        return self._local_llm
+    
+    def _record_gemini_failure(self):
+        """Count a failed Gemini call; disable Gemini once the streak hits the threshold"""
+        self._gemini_fail_streak += 1
+        if self._gemini_fail_streak >= self._gemini_fail_threshold:
+            self.gemini_available = False
+            logger.warning(f"⚠️ Gemini disabled after {self._gemini_fail_streak} consecutive failures")
+    
+    def _engines(self) -> List[str]:
+        """Engines currently available (Gemini drops out when the circuit breaker trips)"""
+        return [name for name, ok in (
+            ("gemini", self.gemini_available),
+            ("easyocr", self.easyocr_available),
+            ("local_llm", self.local_llm_available),
+        ) if ok]
+    
+    def _cache_key(self, image_source: Any) -> str:
+        """Cache key from the image content hash and the available engines"""
+        h = hashlib.blake2b(digest_size=16)
+        if isinstance(image_source, (str, os.PathLike)):
+            with open(image_source, 'rb', buffering=HASH_CHUNK_SIZE) as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    h.update(chunk)
+        elif isinstance(image_source, np.ndarray):
+            h.update(str(image_source.shape).encode())
+            h.update(np.ascontiguousarray(image_source))
+        else:
+            h.update(image_source)
+        return f"{h.hexdigest()}:{'+'.join(self._engines())}"
+    
+    def _is_cached(self, cache_key: Optional[str]) -> bool:
+        """Whether a result for this cache key is already in the cache"""
+        if self._cache is None or cache_key is None:
+            return False
+        try:
+            return self._cache.execute("SELECT 1 FROM cache WHERE k = ?",
+                                       (cache_key,)).fetchone() is not None
+        except Exception:
+            return False
+    
+    def extract(self, image_source: Any, use_cache: bool = True,
+                doc_id: Optional[str] = None, cache_key: Optional[str] = None,
+                gemini_result: Any = _NOT_FETCHED,
+                ocr_result: Any = _NOT_FETCHED) -> Dict[str, Any]:
         """
         Extract invoice data using hybrid approach.
+        
+        image_source may be a file path, encoded image bytes or an RGB/grayscale
+        array (e.g. a rendered PDF page); pass doc_id for in-memory images.
+        
+        Results are cached by image content, so repeated or duplicate images
+        skip the pipeline entirely. Pass use_cache=False to force extraction,
+        or cache_key when the image has already been hashed.
+        
+        gemini_result is a Gemini response already fetched for this image (by
+        a batched request); it is used instead of calling Gemini again, and
+        None means that request already failed. ocr_result is likewise an
+        EasyOCR result from a batched pass.
         """
-        doc_id = Path(image_path).stem
+        if doc_id is None:
+            doc_id = Path(image_source).stem if isinstance(image_source, (str, os.PathLike)) else "document"
         start_time = time.time()
         extraction_method = 'failed'
         
+        if not (use_cache and self._cache is not None):
+            cache_key = None
+        else:
+            try:
+                cache_key = cache_key or self._cache_key(image_source)
+                row = self._cache.execute("SELECT v FROM cache WHERE k = ?", (cache_key,)).fetchone()
+                cached = _json.loads(row[0]) if row else None
+            except Exception as e:
+                logger.warning(f"⚠️ Cache lookup failed for {doc_id}: {e}")
+                cached = None
+            if cached is not None:
+                logger.info(f"♻️ Cache hit for {doc_id}")
+                cached.update(doc_id=doc_id, cost_estimate_usd=0.0,
+                              processing_time_sec=round(time.time() - start_time, 2))
+                return cached
+        
         result = None
+        # Engines that can serve this document; any that fail on it are dropped,
+        # so a degraded result is never cached under the full engine set
+        engines = self._engines()
         
         # ───────────────────────────────────────────────────────────────────
         # STRATEGY 1: Gemini Vision API (Online)
         # ───────────────────────────────────────────────────────────────────
-        # Skip Gemini if keys are empty or explicitly disabled (user instructions)
-        # For this specific task, we prioritize offline if requested, but keep logic generic
+        # Skipped when no API keys are configured (offline mode) or after repeated failures
         if self.gemini_available:
             try:
-                # Check for explicit "no internet" mode request via config or implication
-                # For now we try if available, but users mentioned NO INTERNET, so keys might be invalid anyway
-                # If valid keys exist, we assume online. If not, we skip.
-                if any(k.startswith("AI") for k in API_KEYS):
-                    result = self.gemini.extract(image_path)
-                    if result and result.get('confidence', 0) > 0:
-                        extraction_method = 'gemini'
-                        logger.info(f"✅ Gemini extraction successful for {doc_id}")
+                if gemini_result is _NOT_FETCHED:
+                    gemini_result = self.gemini.extract(image_source)
+                if gemini_result and gemini_result.get('confidence', 0) > 0:
+                    result = gemini_result
+                    extraction_method = 'gemini'
+                    self._gemini_fail_streak = 0
+                    logger.info(f"✅ Gemini extraction successful for {doc_id}")
+                else:
+                    engines.remove("gemini")
+                    self._record_gemini_failure()
             except Exception as e:
                 logger.warning(f"⚠️ Gemini failed for {doc_id}: {e}")
                 result = None
+                engines.remove("gemini")
+                self._record_gemini_failure()
         
         # ───────────────────────────────────────────────────────────────────
         # STRATEGY 2: EasyOCR + Local LLM (Offline)
@@ -81,19 +281,23 @@ class HybridExtractor:
             logger.info(f"🔄 Running offline pipeline (EasyOCR + Local LLM) for {doc_id}")
             try:
                 # Step A: OCR Extraction (Text + Visual Features)
-                ocr_result = self.easyocr.extract(image_path)
+                if ocr_result is _NOT_FETCHED:
+                    ocr_result = self.easyocr.extract(image_source)
                 
                 if ocr_result:
                     result = ocr_result
                     extraction_method = 'easyocr'
                     
-                    # Step B: LLM Parsing (if available and text exists)
-                    if self.local_llm_available and ocr_result.get('raw_text'):
+                    # Step B: LLM Parsing (if available, text exists and the regexes missed a field)
+                    complete = all(ocr_result.get(field) is not None for field in LLM_FIELDS)
+                    if self.local_llm_available and ocr_result.get('raw_text') and not complete:
                         logger.info(f"🧠 improving result with Local LLM for {doc_id}")
-                        llm_result = self.local_llm.extract(ocr_result['raw_text'])
+                        llm_result = self.local_llm.extract(ocr_result['raw_text'], partial=ocr_result)
                         
-                        if llm_result:
-                            # Merge LLM fields (they are usually better than regex)
+                        if not llm_result:
+                            engines.remove("local_llm")
+                        else:
+                            # Merge the fields the LLM filled in
                             if llm_result.get('dealer_name'): result['dealer_name'] = llm_result['dealer_name']
                             if llm_result.get('model_name'): result['model_name'] = llm_result['model_name']
                             if llm_result.get('horse_power'): result['horse_power'] = llm_result['horse_power']
@@ -111,12 +315,7 @@ class HybridExtractor:
         # HANDLE FAILURE
         # ───────────────────────────────────────────────────────────────────
         if result is None:
-            result = {
-                'dealer_name': None, 'model_name': None, 'horse_power': None, 'asset_cost': None,
-                'signature_present': False, 'signature_bbox': None,
-                'stamp_present': False, 'stamp_bbox': None,
-                'confidence': 0.0, 'extraction_method': 'failed'
-            }
+            extraction_method = 'failed'
             logger.error(f"❌ All extraction methods failed for {doc_id}")
         
         # Calculate processing time
@@ -125,29 +324,93 @@ class HybridExtractor:
         # ───────────────────────────────────────────────────────────────────
         # FORMAT OUTPUT
         # ───────────────────────────────────────────────────────────────────
-        return {
-            "doc_id": doc_id,
-            "fields": {
-                "dealer_name": result.get('dealer_name'),
-                "model_name": result.get('model_name'),
-                "horse_power": result.get('horse_power'),
-                "asset_cost": result.get('asset_cost'),
-                "signature": {
-                    "present": result.get('signature_present', False),
-                    "bbox": result.get('signature_bbox')
-                },
-                "stamp": {
-                    "present": result.get('stamp_present', False),
-                    "bbox": result.get('stamp_bbox')
-                }
-            },
-            "confidence": result.get('confidence', 0.0),
-            "processing_time_sec": round(processing_time, 2),
-            "cost_estimate_usd": 0.0003 if extraction_method == 'gemini' else 0.0,
-            "extraction_method": extraction_method
-        }
+        output = ExtractResult.from_raw(doc_id, result, extraction_method,
+                                        round(processing_time, 2)).to_dict()
+        
+        if cache_key is not None and extraction_method != 'failed':
+            # Stored under the engines that actually served this document
+            cache_key = f"{cache_key.partition(':')[0]}:{'+'.join(engines)}"
+            try:
+                self._cache.execute("INSERT OR REPLACE INTO cache VALUES (?, ?)",
+                                    (cache_key, _json.dumps(output)))
+            except Exception as e:
+                logger.warning(f"⚠️ Cache write failed for {doc_id}: {e}")
+        
+        return output
+    
+    @staticmethod
+    def _batch_entry(path: str, result: Any, timestamp: str, pbar, done: int, total: int) -> Dict:
+        """Finish a batch result (or the exception it raised) and report progress"""
+        p = Path(path)
+        if isinstance(result, Exception):
+            logger.error(f"❌ Failed to process {path}: {result}")
+            result = {
+                "doc_id": p.stem,
+                "source_file": str(path),
+                "error": str(result),
+                "confidence": 0,
+                "extraction_method": "failed",
+                "timestamp": timestamp
+            }
+            status = f"❌ Failed: {result['error'][:30]}"
+        else:
+            result["source_file"] = str(path)
+            result["timestamp"] = timestamp
+            status = "✅ Done" if result.get('confidence', 0) > 0.5 else "⚠️ Done"
+        
+        if pbar is not None:
+            pbar.update(1)
+        else:
+            print(f"  [{done}/{total}] {p.name}... {status}")
+        return result
     
-    def process_batch(self, image_paths: List[str], output_path: str) -> List[Dict]:
+    def extract_group(self, image_paths: List[str], images: Optional[List[Any]] = None) -> List[Any]:
+        """
+        Extract a small group of documents, sharing one Gemini request (and one
+        batched OCR pass for any Gemini could not handle) between the ones not
+        already cached. Documents that raise are returned as the
+        exception so the caller can record them.
+        
+        images optionally holds the documents' contents already read into
+        memory (same order as image_paths, which then only name the documents).
+        """
+        sources = images if images is not None else image_paths
+        
+        # Hash each document once; extract() reuses the key
+        cache_keys = {}
+        if self._cache is not None:
+            for i, source in enumerate(sources):
+                try:
+                    cache_keys[i] = self._cache_key(source)
+                except Exception:
+                    pass  # Unreadable; extract() reports it
+        
+        gemini_results, ocr_results = {}, {}
+        if len(sources) > 1:
+            uncached = [i for i in range(len(sources)) if not self._is_cached(cache_keys.get(i))]
+            if self.gemini_available and len(uncached) > 1:
+                fetched = self.gemini.extract_batch([sources[i] for i in uncached])
+                gemini_results = dict(zip(uncached, fetched))
+                # Only the documents Gemini could not extract go on to OCR
+                uncached = [i for i in uncached
+                            if not (gemini_results[i] and gemini_results[i].get('confidence', 0) > 0)]
+            if self.easyocr_available and len(uncached) > 1:
+                fetched = self.easyocr.extract_batch([sources[i] for i in uncached])
+                ocr_results = dict(zip(uncached, fetched))
+        
+        results = []
+        for i, (path, source) in enumerate(zip(image_paths, sources)):
+            try:
+                results.append(self.extract(source, doc_id=Path(path).stem,
+                                            cache_key=cache_keys.get(i),
+                                            gemini_result=gemini_results.get(i, _NOT_FETCHED),
+                                            ocr_result=ocr_results.get(i, _NOT_FETCHED)))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    def process_batch(self, image_paths: List[str], output_path: str,
+                      workers: Optional[int] = None) -> List[Dict]:
         """
         Process multiple documents in batch mode.
         
@@ -155,67 +418,114 @@ class HybridExtractor:
             - Progress tracking with status updates
             - Combined output with batch statistics
             - Error handling for individual documents
+            - Documents processed in parallel worker processes
+            - Gemini requests shared by groups of GEMINI_BATCH_SIZE documents
+              (OCR passes by groups of OCR_BATCH_SIZE when Gemini is off)
+            - Each result appended to `<output_path>.jsonl` as it completes;
+              documents already recorded there are not processed again
         
         Args:
             image_paths: List of paths to invoice images
             output_path: Path to save the combined JSON output
+            workers: Worker processes (default DEFAULT_BATCH_WORKERS; 1 = sequential)
             
         Returns:
             List of extraction results for all documents
         """
-        results = []
         total = len(image_paths)
+        results = [None] * total
         batch_start_time = time.time()
+        batch_timestamp = datetime.now().isoformat()
+        sink_path = output_path + ".jsonl"
+        
+        # Resume from a previous (interrupted) run
+        completed = load_completed(sink_path)
+        pending = []
+        for i, path in enumerate(image_paths):
+            previous = completed.get(Path(path).stem)
+            if previous is not None:
+                results[i] = previous
+            else:
+                pending.append(i)
+        remaining = len(pending)
+        if remaining < total:
+            print(f"  Resuming: {total - remaining} document(s) already in {sink_path}")
+        
+        if workers is None:
+            workers = DEFAULT_BATCH_WORKERS
+        workers = max(1, min(workers, remaining))
         
         # Try to use tqdm for progress bar if available
         try:
             from tqdm import tqdm
-            iterator = tqdm(image_paths, desc="📄 Processing invoices", unit="doc")
-            use_tqdm = True
+            pbar = tqdm(total=remaining, desc="📄 Processing invoices", unit="doc")
         except ImportError:
-            iterator = image_paths
-            use_tqdm = False
+            pbar = None
         
         # ───────────────────────────────────────────────────────────────────
         # PROCESS EACH DOCUMENT
         # ───────────────────────────────────────────────────────────────────
-        for i, path in enumerate(iterator):
-            if not use_tqdm:
-                print(f"  [{i+1}/{total}] Processing: {Path(path).name}...", end=" ", flush=True)
-            
-            try:
-                result = self.extract(path)
-                result["source_file"] = str(path)
-                result["timestamp"] = datetime.now().isoformat()
-                results.append(result)
-                
-                if not use_tqdm:
-                    status = "✅" if result.get('confidence', 0) > 0.5 else "⚠️"
-                    print(f"{status} Done")
-                    
-            except Exception as e:
-                logger.error(f"❌ Failed to process {path}: {e}")
-                error_result = {
-                    "doc_id": Path(path).stem,
-                    "source_file": str(path),
-                    "error": str(e),
-                    "confidence": 0,
-                    "extraction_method": "failed",
-                    "timestamp": datetime.now().isoformat()
-                }
-                results.append(error_result)
-                
-                if not use_tqdm:
-                    print(f"❌ Failed: {str(e)[:30]}")
+        # Group documents so Gemini (or, offline, batched OCR) can serve several at once
+        group_size = GEMINI_BATCH_SIZE if self.gemini_available else OCR_BATCH_SIZE
+        groups = [pending[j:j + group_size] for j in range(0, remaining, group_size)]
+        done = 0
+        
+        # Each record is flushed as it is written, so a killed run loses none of them
+        with open(sink_path, 'ab', buffering=1 << 16) as sink:
+            if workers > 1:
+                # Torch (EasyOCR) is not fork-safe: spawn workers, each building its own extractor
+                executor = ProcessPoolExecutor(max_workers=workers,
+                                               mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=get_hybrid_extractor,
+                                               initargs=(self.use_cache,))
+                with executor:
+                    completions = bounded_completion(
+                        lambda g: executor.submit(_extract_group_in_worker, [image_paths[i] for i in g],
+                                                  self.use_cache),
+                        groups, workers * MAX_IN_FLIGHT_PER_WORKER)
+                    for group, future in completions:
+                        try:
+                            group_results = future.result()
+                        except Exception as e:
+                            group_results = [e] * len(group)
+                        for i, result in zip(group, group_results):
+                            done += 1
+                            results[i] = self._batch_entry(image_paths[i], result, batch_timestamp,
+                                                           pbar, done, remaining)
+                            sink.write(_json.dumps(results[i]) + b"\n")
+                            sink.flush()
+            else:
+                # Read the next group's files from disk while the current group is extracted
+                with ThreadPoolExecutor(max_workers=1) as reader:
+                    upcoming = reader.submit(_read_files, [image_paths[i] for i in groups[0]]) if groups else None
+                    for n, group in enumerate(groups):
+                        images = upcoming.result()
+                        if n + 1 < len(groups):
+                            upcoming = reader.submit(_read_files, [image_paths[i] for i in groups[n + 1]])
+                        group_results = self.extract_group([image_paths[i] for i in group], images)
+                        for i, result in zip(group, group_results):
+                            done += 1
+                            results[i] = self._batch_entry(image_paths[i], result, batch_timestamp,
+                                                           pbar, done, remaining)
+                            sink.write(_json.dumps(results[i]) + b"\n")
+                            sink.flush()
+        
+        if pbar is not None:
+            pbar.close()
         
         # ───────────────────────────────────────────────────────────────────
         # CALCULATE BATCH STATISTICS
         # ───────────────────────────────────────────────────────────────────
         batch_time = time.time() - batch_start_time
-        successful = sum(1 for r in results if r.get('confidence', 0) > 0)
+        successful = 0
+        total_cost = conf_sum = 0.0
+        for r in results:
+            conf = r.get('confidence', 0)
+            successful += conf > 0
+            conf_sum += conf
+            total_cost += r.get('cost_estimate_usd', 0)
         failed = total - successful
-        total_cost = sum(r.get('cost_estimate_usd', 0) for r in results)
-        avg_confidence = sum(r.get('confidence', 0) for r in results) / total if total > 0 else 0
+        avg_confidence = conf_sum / total if total > 0 else 0
         
         # ───────────────────────────────────────────────────────────────────
         # SAVE COMBINED OUTPUT
@@ -235,14 +545,14 @@ class HybridExtractor:
             "documents": results
         }
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(batch_output, f, indent=2, ensure_ascii=False)
+        _json.dump_file(batch_output, output_path)
+        os.remove(sink_path)  # Complete; a later run on this path starts fresh
         
         # Print summary
-        print(f"\n{'═' * 50}")
+        print(f"\n{_SUMMARY_RULE}")
         print(f"📊 Batch Complete: {successful}/{total} successful ({failed} failed)")
         print(f"⏱️  Total time: {batch_time:.2f}s | Avg: {batch_time/total:.2f}s per doc")
         print(f"💵 Total cost: ${total_cost:.4f}")
-        print(f"{'═' * 50}")
+        print(_SUMMARY_RULE)
         
         return results
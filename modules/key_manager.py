@@ -1,5 +1,8 @@
 import time
+import heapq
 import logging
+import threading
+from collections import deque
 from typing import List
 
 logging.basicConfig(level=logging.INFO)
@@ -10,39 +13,55 @@ class RoundRobinKeyManager:
     
     def __init__(self, keys: List[str]):
         self.keys = keys
-        self.current_index = 0
-        self.key_cooldowns = {}  # key -> timestamp when it can be used again
         self.cooldown_duration = 60  # seconds to wait after rate limit
+        self._ready = deque(keys)  # rotation order of usable keys
+        self._in_ready = set(keys)
+        self._cooldown_heap = []  # (timestamp when usable again, key), earliest first
+        self._cooling = {}  # key -> timestamp when it can be used again
+        # Guards all state; get_key waits on it (lock released) while every key is cooling
+        self._cond = threading.Condition(threading.Lock())
+    
+    def _release_expired(self, now: float):
+        """Move keys whose cooldown has expired back into the rotation"""
+        heap = self._cooldown_heap
+        while heap and heap[0][0] <= now:
+            available_at, key = heapq.heappop(heap)
+            if self._cooling.get(key) != available_at:
+                continue  # Superseded by a later rate limit
+            del self._cooling[key]
+            if key not in self._in_ready:
+                self._ready.append(key)
+                self._in_ready.add(key)
     
     def get_key(self) -> str:
         """Get next available API key using round-robin"""
-        current_time = time.time()
-        
-        # Try all keys in round-robin fashion
-        for _ in range(len(self.keys)):
-            key = self.keys[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.keys)
-            
-            # Check if key is on cooldown
-            if key in self.key_cooldowns:
-                if current_time < self.key_cooldowns[key]:
-                    continue  # Skip this key, it's on cooldown
-                else:
-                    del self.key_cooldowns[key]  # Cooldown expired
+        with self._cond:
+            if not self.keys:
+                raise RuntimeError("No API keys configured")
             
-            return key
-        
-        # All keys on cooldown - wait for shortest cooldown
-        min_wait = min(self.key_cooldowns.values()) - current_time
-        if min_wait > 0:
-            logger.warning(f"All API keys on cooldown. Waiting {min_wait:.1f}s...")
-            time.sleep(min_wait + 1)
-        
-        # Reset and return first key
-        self.key_cooldowns.clear()
-        return self.keys[0]
+            while True:
+                now = time.time()
+                self._release_expired(now)
+                
+                # Rotate through ready keys, dropping any that went on cooldown
+                while self._ready:
+                    key = self._ready.popleft()
+                    if key in self._cooling:
+                        self._in_ready.discard(key)
+                        continue
+                    self._ready.append(key)
+                    return key
+                
+                # All keys on cooldown - wait for the earliest one
+                min_wait = self._cooldown_heap[0][0] - now
+                logger.warning(f"All API keys on cooldown. Waiting {min_wait:.1f}s...")
+                self._cond.wait(max(min_wait, 0))
     
     def mark_rate_limited(self, key: str):
         """Mark a key as rate limited"""
-        self.key_cooldowns[key] = time.time() + self.cooldown_duration
-        logger.warning(f"Key rate limited. {len(self.key_cooldowns)}/{len(self.keys)} keys on cooldown")
+        with self._cond:
+            available_at = time.time() + self.cooldown_duration
+            self._cooling[key] = available_at
+            heapq.heappush(self._cooldown_heap, (available_at, key))
+            on_cooldown = len(self._cooling)
+        logger.warning(f"Key rate limited. {on_cooldown}/{len(self.keys)} keys on cooldown")
@@ -1,47 +1,166 @@
 
 import logging
-import json
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+
+from . import _json
 
 logger = logging.getLogger(__name__)
 
+# GGUF model downloaded by setup_model.py
+DEFAULT_MODEL_PATH = "models/model.gguf"
+
+# Token generation leaves a core free for the rest of the pipeline; prompt
+# prefill (the whole OCR text) is compute-bound and uses every core
+N_THREADS = max(1, (os.cpu_count() or 4) - 1)
+N_THREADS_BATCH = os.cpu_count() or 4
+N_BATCH = 512  # Prompt tokens evaluated per llama_decode call
+
+# Generation cap. The grammar does not bound string lengths, so this only stops
+# a runaway value; a normal answer is a few dozen tokens and ends well before it
+MAX_OUTPUT_TOKENS = 256
+
+# Prompts are static up to the invoice text, so every call shares the same
+# token prefix. llama.cpp keeps the previous call's KV state in the Llama
+# instance and only evaluates the tokens after the common prefix, so no
+# explicit prompt cache is attached
+SYSTEM_PROMPT = """You are a precise document extraction AI. 
+Your task is to extract specific information from the invoice text provided.
+Return the output ONLY as a valid JSON object. Do not add markdown or explanations.
+"""
+
+# Fields the LLM fills in, in output order, with their prompt descriptions
+LLM_FIELDS = {
+    "dealer_name": "The name of the tractor dealer or agency.",
+    "model_name": "The model of the tractor (e.g., Swaraj 744, Mahindra 575).",
+    "horse_power": "The HP of the tractor (e.g., 50 HP).",
+    "asset_cost": "The total cost or price of the tractor (number only, remove currency symbols).",
+}
+
+
+def _extraction_prompt(fields: Tuple[str, ...]) -> str:
+    """User prompt preamble asking for the given fields (the invoice text follows it)"""
+    numbered = "\n".join(f'{i}. "{field}": {LLM_FIELDS[field]}' for i, field in enumerate(fields, 1))
+    return (f"Extract the following fields from the text below:\n{numbered}\n\n"
+            "If a field is not found, set it to null.\n\nInvoice Text:\n")
+
+
+EXTRACTION_PROMPT = _extraction_prompt(tuple(LLM_FIELDS))
+
+# GBNF grammar for the extraction output: decoding can only produce a JSON
+# object with the requested fields (in order), so the response always parses
+_GRAMMAR_RULES = r'''
+strnull ::= string | "null"
+cost    ::= number | string | "null"
+string  ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ["\\/bfnrt] )* "\""
+number  ::= [0-9]+ ("." [0-9]+)?
+ws      ::= [ \n]?
+'''
+
+
+def _extraction_grammar(fields: Tuple[str, ...]) -> str:
+    """GBNF grammar for a JSON object holding exactly the given fields"""
+    members = ' "," ws '.join(
+        f'"\\"{field}\\":" ws {"cost" if field == "asset_cost" else "strnull"}' for field in fields)
+    return f'\nroot    ::= "{{" ws {members} ws "}}"{_GRAMMAR_RULES}'
+
+
+EXTRACTION_GRAMMAR = _extraction_grammar(tuple(LLM_FIELDS))
+
+# Reinstalls llama-cpp-python with CUDA support (the default wheel is CPU-only)
+CUDA_INSTALL_CMD = 'CMAKE_ARGS="-DGGML_CUDA=on" pip install llama-cpp-python --force-reinstall --no-cache-dir'
+
+
+def llama_gpu_offload_supported() -> bool:
+    """Whether the installed llama-cpp-python build can offload layers to a GPU"""
+    try:
+        from llama_cpp import llama_supports_gpu_offload
+        return bool(llama_supports_gpu_offload())
+    except Exception:
+        return False
+
 class LocalLLMExtractor:
     """
     Local LLM Extractor using llama-cpp-python.
     Runs completely offline using a GGUF model.
     """
     
-    def __init__(self, model_path: str = "models/model.gguf"):
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH):
         self.llm = None
+        self._grammars = {}  # requested fields -> compiled LlamaGrammar
         self.initialized = False
+        self.gpu_offload = False
         
         if os.path.exists(model_path):
             try:
                 # Import here to avoid hard dependency if not installed
+                import llama_cpp
                 from llama_cpp import Llama
                 
+                # n_gpu_layers is silently ignored by CPU-only builds
+                self.gpu_offload = llama_gpu_offload_supported()
+                if not self.gpu_offload:
+                    logger.warning("⚠️ llama-cpp-python was built without GPU support; "
+                                   f"the Local LLM runs on CPU. For CUDA: {CUDA_INSTALL_CMD}")
+                
                 logger.info(f"Loading Local LLM from {model_path}...")
                 # Load model - adjust n_gpu_layers based on available hardware, -1 means all if possible
-                self.llm = Llama(
+                llm_kwargs = dict(
                     model_path=model_path,
                     n_ctx=4096,      # Context window
                     n_gpu_layers=-1, # Offload to GPU if available
-                    n_threads=4,     # CPU threads
+                    n_threads=N_THREADS,
+                    n_threads_batch=N_THREADS_BATCH,
+                    n_batch=N_BATCH,
+                    n_ubatch=N_BATCH,
+                    use_mmap=True,   # Map the weights instead of reading them in
+                    use_mlock=True,  # Keep them resident between calls (warns if the memlock limit is too low)
                     verbose=False
                 )
+                try:
+                    q8_0 = getattr(llama_cpp, 'GGML_TYPE_Q8_0', 8)  # Not exported by every build
+                    self.llm = Llama(
+                        **llm_kwargs,
+                        flash_attn=True, # Fused attention kernel (required for a quantized V cache)
+                        type_k=q8_0,     # 8-bit KV cache: half the bytes read per decoded token
+                        type_v=q8_0,
+                    )
+                except Exception as e:
+                    # Older builds and some backends lack flash attention / quantized KV
+                    logger.warning(f"⚠️ Flash attention with a Q8_0 KV cache unavailable ({e}); "
+                                   "falling back to the default f16 KV cache")
+                    self.llm = Llama(**llm_kwargs)
+                self._grammar(tuple(LLM_FIELDS))  # Compile the full grammar up front
                 self.initialized = True
-                logger.info("✅ Local LLM initialized successfully")
+                logger.info(f"✅ Local LLM initialized successfully ({'GPU' if self.gpu_offload else 'CPU'})")
             except Exception as e:
                 logger.error(f"❌ Failed to initialize Local LLM: {e}")
                 logger.warning("Please ensure 'llama-cpp-python' is installed and the model file is valid.")
         else:
             logger.warning(f"⚠️ Local LLM model not found at {model_path}. Run 'setup_model.py' to download it.")
 
-    def extract(self, text: str) -> Optional[Dict[str, Any]]:
+    def _grammar(self, fields: Tuple[str, ...]):
+        """Compiled output grammar for the given fields (built once per field set)"""
+        grammar = self._grammars.get(fields)
+        if grammar is None:
+            from llama_cpp import LlamaGrammar
+            grammar = LlamaGrammar.from_string(_extraction_grammar(fields), verbose=False)
+            self._grammars[fields] = grammar
+        return grammar
+
+    def extract(self, text: str, partial: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """
         Extract fields from text using the Local LLM.
+        
+        partial holds fields already found by a cheaper extractor (e.g. the OCR
+        regexes); only the ones that are missing (None) are asked for, and no
+        inference runs at all when none are missing.
         """
+        partial = partial or {}
+        fields = tuple(field for field in LLM_FIELDS if partial.get(field) is None)
+        if not fields:
+            return {field: partial[field] for field in LLM_FIELDS}
+        
         if not self.initialized:
             logger.warning("Local LLM not initialized, skipping extraction.")
             return None
@@ -50,56 +169,35 @@ class LocalLLMExtractor:
             logger.warning("Input text too short for LLM extraction.")
             return None
             
-        system_prompt = """You are a precise document extraction AI. 
-Your task is to extract specific information from the invoice text provided.
-Return the output ONLY as a valid JSON object. Do not add markdown or explanations.
-"""
-
-        user_prompt = f"""Extract the following fields from the text below:
-1. "dealer_name": The name of the tractor dealer or agency.
-2. "model_name": The model of the tractor (e.g., Swaraj 744, Mahindra 575).
-3. "horse_power": The HP of the tractor (e.g., 50 HP).
-4. "asset_cost": The total cost or price of the tractor (number only, remove currency symbols).
-
-If a field is not found, set it to null.
-
-Invoice Text:
-{text}
-"""
+        preamble = EXTRACTION_PROMPT if len(fields) == len(LLM_FIELDS) else _extraction_prompt(fields)
+        user_prompt = f"{preamble}{text}\n"
         
         try:
-            # Use JSON mode if supported or just prompt engineering
+            # Grammar-constrained decoding: the output is always the JSON object
             response = self.llm.create_chat_completion(
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
                 ],
-                response_format={
-                    "type": "json_object",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "dealer_name": {"type": ["string", "null"]},
-                            "model_name": {"type": ["string", "null"]},
-                            "horse_power": {"type": ["string", "null"]},
-                            "asset_cost": {"type": ["number", "string", "null"]},
-                        },
-                        "required": ["dealer_name", "model_name", "horse_power", "asset_cost"]
-                    }
-                },
-                temperature=0.1, # Low temperature for factual extraction
-                max_tokens=512
+                grammar=self._grammar(fields),
+                # Greedy decoding: extraction wants the single most likely answer,
+                # and the sampling filters would only cost time per token
+                temperature=0.0,
+                top_k=1,
+                top_p=1.0,
+                min_p=0.0,
+                repeat_penalty=1.0,
+                max_tokens=MAX_OUTPUT_TOKENS
             )
             
-            content = response['choices'][0]['message']['content']
+            choice = response['choices'][0]
+            if choice.get('finish_reason') == 'length':
+                logger.warning(f"Local LLM output hit the {MAX_OUTPUT_TOKENS}-token cap; discarding it")
+                return None
+            content = choice['message']['content']
             
-            # Parse JSON
-            try:
-                data = json.loads(content)
-            except json.JSONDecodeError:
-                # Fallback clean up if model adds markdown
-                clean_content = content.replace('```json', '').replace('```', '').strip()
-                data = json.loads(clean_content)
+            # The grammar guarantees bare JSON (no markdown fences to strip)
+            data = _json.loads(content)
             
             # Post-process asset_cost to be an integer if possible
             if data.get('asset_cost'):
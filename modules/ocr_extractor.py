@@ -1,180 +1,416 @@
 
 import logging
 import re
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, List, Tuple
 
 try:
     import cv2
     import numpy as np
+
+    # Stamp colours in OpenCV HSV: blue (H 100-130) or red (H 0-10 / 170-180), S and V >= 50
+    _STAMP_HUE_LUT = np.zeros(256, np.uint8)
+    for _lo, _hi in ((100, 130), (0, 10), (170, 180)):
+        _STAMP_HUE_LUT[_lo:_hi + 1] = 255
+    _STAMP_SV_MIN = np.array([0, 50, 50])
+    _STAMP_SV_MAX = np.array([255, 255, 255])
 except ImportError:
     pass
 
+# google-re2 (optional): linear-time matching, so noisy OCR text cannot trigger
+# backtracking blow-ups in patterns such as the dealer name's [\w\s]+ prefix
+try:
+    import re2
+except ImportError:
+    re2 = None
+
 logger = logging.getLogger(__name__)
 
+# re2's \w, \d and \s are ASCII-only; these spell out re's Unicode meaning
+_RE2_CLASSES = {
+    'w': r'\pL\pN_',
+    'd': r'\p{Nd}',
+    's': r'\t\n\v\f\r\x1c-\x1f\x85\pZ',
+}
+
+
+def _to_re2(pattern: str) -> str:
+    r"""Rewrite \w / \d / \s in a pattern to their Unicode-aware re2 equivalents"""
+    out, in_class, i = [], False, 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            esc = pattern[i + 1]
+            if esc in _RE2_CLASSES:
+                body = _RE2_CLASSES[esc]
+                out.append(body if in_class or esc == 'd' else f'[{body}]')
+            else:
+                out.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        out.append(c)
+        i += 1
+    return ''.join(out)
+
+
+def _compile(pattern: str):
+    """
+    Compile a field pattern with re2 when installed, else re. Patterns are
+    lowercase and only ever see lowercased text, so no case folding is needed.
+    """
+    if re2 is not None:
+        return re2.compile(_to_re2(pattern))
+    return re.compile(pattern)
+
+
+# ───────────────────────────────────────────────────────────────────────────
+# Field patterns (compiled once per process; matched against lowercased text)
+# ───────────────────────────────────────────────────────────────────────────
+_DEALER_PATTERNS = [_compile(p) for p in (
+    r'([\w\s]+(?:motors?|tractors?|agencies?|enterprises?|pvt\.?\s*ltd\.?|limited))',
+    r'([\w\s]+(?:auto|dealer|agro))',
+)]
+
+# Brands in priority order: when several appear, the earliest listed brand wins
+_BRANDS = ['mahindra', 'swaraj', 'sonalika', 'tata', 'john deere', 'kubota',
+           'new holland', 'escort', 'massey', 'eicher', 'farmtrac', 'force', 'vst']
+_BRAND_PRIORITY = {brand: rank for rank, brand in enumerate(_BRANDS)}
+_BRAND_RE = _compile(r'(' + '|'.join(_BRANDS) + r')\s*(\d{2,4})\s*(di|fe|hp|plus|max|turbo)?')
+
+_HP_PATTERNS = [_compile(p) for p in (
+    r'(\d{2,3})\s*(?:hp|h\.p\.)',
+    r'(?:hp|horse\s*power)[:\s]*(\d{2,3})',
+)]
+
+# Asset cost, in priority order: amount after a cost keyword, after a currency
+# sign, or any 6+ digit number. The three alternatives start with disjoint
+# characters, so one scan finds each one's first occurrence; an amount inside
+# a keyword match also counts for the lower-priority alternatives it satisfies.
+_COST_RE = _compile(
+    r'(?:total|net|amount|cost|price)[:\s]*((?:rs\.?|₹)?)\s*([\d,]+)'
+    r'|(?:rs\.?|₹)\s*([\d,]+)'
+    r'|([\d,]{6,})'
+)
+_MIN_COST, _MAX_COST = 100000, 3000000  # Valid tractor price range
+
+
+def _pick_cost(firsts: list, complete: bool) -> Tuple[bool, Optional[int]]:
+    """
+    Resolve the asset cost from the first amount each cost pattern matched:
+    the highest-priority one in the valid range. Returns (decided, cost);
+    undecided while a higher-priority pattern may still match later text.
+    """
+    for amount in firsts:
+        if amount is None:
+            if not complete:
+                return False, None
+            continue
+        try:
+            cost = int(amount.replace(',', ''))
+        except ValueError:
+            continue
+        if _MIN_COST <= cost <= _MAX_COST:
+            return True, cost
+    return True, None
+
+
+def _asset_cost(text: str) -> Optional[int]:
+    """Asset cost from lowercased invoice text, in one scan (None if not found)"""
+    firsts = [None, None, None]
+    for match in _COST_RE.finditer(text):
+        currency, keyword_amount, currency_amount, number = match.groups()
+        if keyword_amount is not None:
+            found = (keyword_amount, keyword_amount if currency else None, keyword_amount)
+        elif currency_amount is not None:
+            found = (None, currency_amount, currency_amount)
+        else:
+            found = (None, None, number)
+        new = False
+        for tier, amount in enumerate(found):
+            if amount is not None and firsts[tier] is None and (tier < 2 or len(amount) >= 6):
+                firsts[tier] = amount
+                new = True
+        if new:
+            decided, cost = _pick_cost(firsts, complete=False)
+            if decided:
+                return cost
+    return _pick_cost(firsts, complete=True)[1]
+
+# Long edge (px) scans are downscaled to before OCR and signature/stamp detection
+MAX_OCR_SIZE = 1600
+
+# Image sizes whose signature/stamp scratch buffers are kept for reuse
+CV_BUFFER_SIZES = 4
+
+# Documents per batched OCR pass when Gemini is not serving the batch
+OCR_BATCH_SIZE = 8
+
+def _load_bgr(image_source: Any) -> Optional["np.ndarray"]:
+    """Load a file path, encoded image bytes or an RGB/grayscale array as BGR"""
+    if isinstance(image_source, np.ndarray):
+        if image_source.ndim == 2 or image_source.shape[2] == 1:
+            return cv2.cvtColor(image_source, cv2.COLOR_GRAY2BGR)
+        if image_source.shape[2] == 4:
+            return cv2.cvtColor(image_source, cv2.COLOR_RGBA2BGR)
+        return cv2.cvtColor(image_source, cv2.COLOR_RGB2BGR)
+    if isinstance(image_source, (bytes, bytearray)):
+        return cv2.imdecode(np.frombuffer(image_source, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(str(image_source))
+
+
+def _downscale(image: "np.ndarray") -> Tuple["np.ndarray", float]:
+    """Shrink an image to MAX_OCR_SIZE on its long edge; returns it and the scale applied"""
+    scale = MAX_OCR_SIZE / max(image.shape[:2])
+    if scale >= 1:
+        return image, 1.0
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+def _unscale(bbox: List[int], scale: float) -> List[int]:
+    """Map a bbox from a downscaled image back to original-image pixels"""
+    if scale == 1.0:
+        return bbox
+    return [round(v / scale) for v in bbox]
+
+
 class EasyOCRExtractor:
     """EasyOCR-based document extractor (offline, always works)"""
     
-    def __init__(self):
+    def __init__(self, gpu: Optional[bool] = None):
+        """gpu: run on CUDA (default: when available); on CPU the recognizer uses int8 weights"""
         self.reader = None
         self.initialized = False
+        self._local = threading.local()  # Per-thread OpenCV scratch buffers
         try:
             import easyocr
-            self.reader = easyocr.Reader(['en', 'hi'], gpu=False)
+            if gpu is None:
+                import torch
+                gpu = torch.cuda.is_available()
+            self.reader = easyocr.Reader(['en', 'hi'], gpu=gpu, quantize=not gpu,
+                                         cudnn_benchmark=True)
             self.initialized = True
-            logger.info("EasyOCR extractor initialized")
+            logger.info(f"EasyOCR extractor initialized ({'GPU' if gpu else 'CPU'})")
         except Exception as e:
             logger.warning(f"EasyOCR initialization failed: {e}")
     
-    def extract(self, image_path: str) -> Optional[Dict[str, Any]]:
-        """Extract fields using EasyOCR + pattern matching"""
+    def extract(self, image_source: Any) -> Optional[Dict[str, Any]]:
+        """Extract fields using EasyOCR + pattern matching (path, image bytes or array)"""
         if not self.initialized:
             return None
         
         try:
             # Read image
-            image = cv2.imread(image_path)
+            image = _load_bgr(image_source)
             if image is None:
                 return None
+            image, scale = _downscale(image)
             
             # OCR
-            results = self.reader.readtext(image)
-            
-            # Sort results by vertical position (y), then horizontal (x)
-            # result structure: ([[x1, y1], [x2, y2], ...], text, conf)
-            # We take the top-left y coordinate for vertical sorting
-            results.sort(key=lambda r: (r[0][0][1], r[0][0][0]))
-            
-            # Simple line grouping
-            lines = []
-            current_line = []
-            last_y = -1
-            
-            for bbox, text, conf in results:
-                y = bbox[0][1]
-                if last_y != -1 and abs(y - last_y) > 20: # New line threshold
-                     lines.append(" ".join(current_line))
-                     current_line = []
-                current_line.append(text)
-                last_y = y
-            if current_line:
-                lines.append(" ".join(current_line))
-            
-            # Formatted text (preserving newlines)
-            formatted_text = "\n".join(lines)
-            
-            # Flat text for regex (legacy support)
-            full_text = formatted_text.lower().replace('\n', ' ')
-            
-            # Extract dealer name
-            dealer_name = None
-            dealer_patterns = [
-                r'([\w\s]+(?:motors?|tractors?|agencies?|enterprises?|pvt\.?\s*ltd\.?|limited))',
-                r'([\w\s]+(?:auto|dealer|agro))',
-            ]
-            for pattern in dealer_patterns:
-                match = re.search(pattern, full_text, re.IGNORECASE)
-                if match:
-                    dealer_name = match.group(1).strip().title()
-                    break
-            
-            # Extract model name
-            model_name = None
-            brands = ['mahindra', 'swaraj', 'sonalika', 'tata', 'john deere', 'kubota', 
-                     'new holland', 'escort', 'massey', 'eicher', 'farmtrac', 'force', 'vst']
-            for brand in brands:
-                pattern = rf'({brand})\s*(\d{{2,4}})\s*(di|fe|hp|plus|max|turbo)?'
-                match = re.search(pattern, full_text, re.IGNORECASE)
-                if match:
-                    model_name = f"{match.group(1).title()} {match.group(2)}"
-                    if match.group(3):
-                        model_name += f" {match.group(3).upper()}"
-                    break
-            
-            # Extract horse power
-            horse_power = None
-            hp_patterns = [r'(\d{2,3})\s*(?:hp|h\.p\.)', r'(?:hp|horse\s*power)[:\s]*(\d{2,3})']
-            for pattern in hp_patterns:
-                match = re.search(pattern, full_text, re.IGNORECASE)
-                if match:
-                    horse_power = match.group(1)
-                    break
-            
-            # Extract asset cost
-            asset_cost = None
-            cost_patterns = [
-                r'(?:total|net|amount|cost|price)[:\s]*(?:rs\.?|₹)?\s*([\d,]+)',
-                r'(?:rs\.?|₹)\s*([\d,]+)',
-                r'([\d,]{6,})'  # Any 6+ digit number
-            ]
-            for pattern in cost_patterns:
-                match = re.search(pattern, full_text, re.IGNORECASE)
-                if match:
-                    cost_str = match.group(1).replace(',', '')
-                    try:
-                        cost = int(cost_str)
-                        if 100000 <= cost <= 3000000:  # Valid tractor price range
-                            asset_cost = cost
-                            break
-                    except:
-                        pass
-            
-            # Detect signature (look for handwritten marks in lower region)
-            h, w = image.shape[:2]
-            lower_region = image[int(h*0.6):, :]
-            gray = cv2.cvtColor(lower_region, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            signature_present = False
-            signature_bbox = None
-            for cnt in contours:
-                area = cv2.contourArea(cnt)
-                if 500 < area < 50000:
-                    x, y, cw, ch = cv2.boundingRect(cnt)
-                    aspect = cw / max(ch, 1)
-                    if 1.5 < aspect < 10:  # Signature-like shape
-                        signature_present = True
-                        signature_bbox = [x, int(h*0.6) + y, x + cw, int(h*0.6) + y + ch]
-                        break
-            
-            # Detect stamp (look for colored circular regions)
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-            
-            # Blue stamp
-            blue_mask = cv2.inRange(hsv, np.array([100, 50, 50]), np.array([130, 255, 255]))
-            # Red stamp
-            red_mask1 = cv2.inRange(hsv, np.array([0, 50, 50]), np.array([10, 255, 255]))
-            red_mask2 = cv2.inRange(hsv, np.array([170, 50, 50]), np.array([180, 255, 255]))
-            
-            stamp_mask = cv2.bitwise_or(blue_mask, cv2.bitwise_or(red_mask1, red_mask2))
-            stamp_contours, _ = cv2.findContours(stamp_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            stamp_present = False
-            stamp_bbox = None
-            for cnt in stamp_contours:
-                area = cv2.contourArea(cnt)
-                if area > 1000:
-                    x, y, cw, ch = cv2.boundingRect(cnt)
-                    aspect = cw / max(ch, 1)
-                    if 0.5 < aspect < 2:  # Roughly circular
-                        stamp_present = True
-                        stamp_bbox = [x, y, x + cw, y + ch]
-                        break
-            
-            return {
-                'dealer_name': dealer_name,
-                'model_name': model_name,
-                'horse_power': horse_power,
-                'asset_cost': asset_cost,
-                'signature_present': signature_present,
-                'signature_bbox': signature_bbox,
-                'stamp_present': stamp_present,
-                'stamp_bbox': stamp_bbox,
-                'confidence': 0.6,
-                'extraction_method': 'easyocr',
-                'raw_text': formatted_text  # Return layout-preserved text for LLM
-            }
+            return self._fields(image, self.reader.readtext(image), scale)
             
         except Exception as e:
             logger.error(f"EasyOCR extraction failed: {e}")
             return None
+    
+    def extract_batch(self, image_sources: List[Any]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Extract several documents, running the detector over same-sized images
+        in one batched pass. Returns results in input order; None where an
+        image could not be read or recognized.
+        """
+        results = [None] * len(image_sources)
+        if not self.initialized:
+            return results
+        
+        images, scales = [], []
+        for source in image_sources:
+            image, scale = None, 1.0
+            try:
+                image = _load_bgr(source)
+                if image is not None:
+                    image, scale = _downscale(image)
+            except Exception as e:
+                logger.error(f"EasyOCR could not read image: {e}")
+            images.append(image)
+            scales.append(scale)
+        
+        # readtext_batched stacks its inputs into one tensor, so only images of
+        # the same size can share a pass (and keep bboxes in their own pixels)
+        by_size = {}
+        for i, image in enumerate(images):
+            if image is not None:
+                by_size.setdefault(image.shape[:2], []).append(i)
+        
+        for indices in by_size.values():
+            try:
+                if len(indices) > 1:
+                    ocr = self.reader.readtext_batched([images[i] for i in indices])
+                else:
+                    ocr = [self.reader.readtext(images[indices[0]])]
+            except Exception as e:
+                if len(indices) == 1:
+                    logger.error(f"EasyOCR extraction failed: {e}")
+                    continue
+                logger.warning(f"EasyOCR batch extraction failed, reading images one by one: {e}")
+                ocr = []
+                for i in indices:
+                    try:
+                        ocr.append(self.reader.readtext(images[i]))
+                    except Exception as e:
+                        logger.error(f"EasyOCR extraction failed: {e}")
+                        ocr.append(None)
+            for i, texts in zip(indices, ocr):
+                if texts is None:
+                    continue
+                try:
+                    results[i] = self._fields(images[i], texts, scales[i])
+                except Exception as e:
+                    logger.error(f"EasyOCR extraction failed: {e}")
+        return results
+    
+    def _buffers(self, h: int, w: int) -> Dict[str, "np.ndarray"]:
+        """Scratch arrays for the signature/stamp passes, reused across same-sized images"""
+        cache = getattr(self._local, 'buffers', None)
+        if cache is None:
+            cache = self._local.buffers = {}
+        buffers = cache.get((h, w))
+        if buffers is None:
+            if len(cache) >= CV_BUFFER_SIZES:
+                cache.pop(next(iter(cache)))  # Drop the oldest size
+            lower_h = h - int(h*0.6)
+            buffers = cache[(h, w)] = {
+                'gray': np.empty((lower_h, w), np.uint8),
+                'edges': np.empty((lower_h, w), np.uint8),
+                'hsv': np.empty((h, w, 3), np.uint8),
+                'hue': np.empty((h, w), np.uint8),
+                'hue_mask': np.empty((h, w), np.uint8),
+                'sv_mask': np.empty((h, w), np.uint8),
+                'stamp_mask': np.empty((h, w), np.uint8),
+            }
+        return buffers
+    
+    def _fields(self, image: "np.ndarray", results: list, scale: float = 1.0) -> Dict[str, Any]:
+        """
+        Invoice fields from an image and its EasyOCR readings. scale is the
+        factor the image was downscaled by; pixel thresholds are scaled to
+        match and bboxes are returned in original-image coordinates.
+        """
+        # Sort results by vertical position (y), then horizontal (x)
+        # result structure: ([[x1, y1], [x2, y2], ...], text, conf)
+        # We take the top-left y coordinate for vertical sorting
+        results.sort(key=lambda r: (r[0][0][1], r[0][0][0]))
+        
+        # Simple line grouping
+        lines = []
+        current_line = []
+        last_y = -1
+        
+        for bbox, text, conf in results:
+            y = bbox[0][1]
+            if last_y != -1 and abs(y - last_y) > 20 * scale: # New line threshold
+                 lines.append(" ".join(current_line))
+                 current_line = []
+            current_line.append(text)
+            last_y = y
+        if current_line:
+            lines.append(" ".join(current_line))
+        
+        # Formatted text (preserving newlines)
+        formatted_text = "\n".join(lines)
+        
+        # Flat text for regex (legacy support)
+        full_text = formatted_text.lower().replace('\n', ' ')
+        
+        # Extract dealer name
+        dealer_name = None
+        for pattern in _DEALER_PATTERNS:
+            match = pattern.search(full_text)
+            if match:
+                dealer_name = match.group(1).strip().title()
+                break
+        
+        # Extract model name
+        # (one scan over all brands, keeping the highest-priority brand's first match)
+        model_name = None
+        best, best_rank = None, len(_BRANDS)
+        for match in _BRAND_RE.finditer(full_text):
+            rank = _BRAND_PRIORITY[match.group(1)]
+            if rank < best_rank:
+                best, best_rank = match, rank
+                if rank == 0:
+                    break
+        if best:
+            model_name = f"{best.group(1).title()} {best.group(2)}"
+            if best.group(3):
+                model_name += f" {best.group(3).upper()}"
+        
+        # Extract horse power
+        horse_power = None
+        for pattern in _HP_PATTERNS:
+            match = pattern.search(full_text)
+            if match:
+                horse_power = match.group(1)
+                break
+        
+        # Extract asset cost
+        asset_cost = _asset_cost(full_text)
+        
+        # Detect signature (look for handwritten marks in lower region)
+        area_scale = scale * scale
+        h, w = image.shape[:2]
+        buf = self._buffers(h, w)
+        lower_region = image[int(h*0.6):, :]
+        gray = cv2.cvtColor(lower_region, cv2.COLOR_BGR2GRAY, dst=buf['gray'])
+        edges = cv2.Canny(gray, 50, 150, edges=buf['edges'])
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        signature_present = False
+        signature_bbox = None
+        for cnt in contours:
+            area = cv2.contourArea(cnt)
+            if 500 * area_scale < area < 50000 * area_scale:
+                x, y, cw, ch = cv2.boundingRect(cnt)
+                aspect = cw / max(ch, 1)
+                if 1.5 < aspect < 10:  # Signature-like shape
+                    signature_present = True
+                    signature_bbox = _unscale([x, int(h*0.6) + y, x + cw, int(h*0.6) + y + ch], scale)
+                    break
+        
+        # Detect stamp (look for colored circular regions)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=buf['hsv'])
+        
+        # Blue or red hue (table lookup), with enough saturation and value
+        hue_mask = cv2.LUT(cv2.extractChannel(hsv, 0, dst=buf['hue']), _STAMP_HUE_LUT, dst=buf['hue_mask'])
+        sv_mask = cv2.inRange(hsv, _STAMP_SV_MIN, _STAMP_SV_MAX, dst=buf['sv_mask'])
+        stamp_mask = cv2.bitwise_and(hue_mask, sv_mask, dst=buf['stamp_mask'])
+        stamp_contours, _ = cv2.findContours(stamp_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        stamp_present = False
+        stamp_bbox = None
+        for cnt in stamp_contours:
+            area = cv2.contourArea(cnt)
+            if area > 1000 * area_scale:
+                x, y, cw, ch = cv2.boundingRect(cnt)
+                aspect = cw / max(ch, 1)
+                if 0.5 < aspect < 2:  # Roughly circular
+                    stamp_present = True
+                    stamp_bbox = _unscale([x, y, x + cw, y + ch], scale)
+                    break
+        
+        return {
+            'dealer_name': dealer_name,
+            'model_name': model_name,
+            'horse_power': horse_power,
+            'asset_cost': asset_cost,
+            'signature_present': signature_present,
+            'signature_bbox': signature_bbox,
+            'stamp_present': stamp_present,
+            'stamp_bbox': stamp_bbox,
+            'confidence': 0.6,
+            'extraction_method': 'easyocr',
+            'raw_text': formatted_text  # Return layout-preserved text for LLM
+        }
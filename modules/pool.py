@@ -0,0 +1,26 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# Submitted-but-unfinished documents allowed per worker in parallel batches
+MAX_IN_FLIGHT_PER_WORKER = 2
+
+
+def bounded_completion(submit, items: list, max_in_flight: int):
+    """
+    Yield (item, future) pairs as futures complete, keeping at most
+    `max_in_flight` submitted at a time so workers stay busy behind one slow
+    document without queueing (and holding) every pending input up front.
+    """
+    items = iter(items)
+    in_flight = {}
+    for item in items:
+        in_flight[submit(item)] = item
+        if len(in_flight) >= max_in_flight:
+            break
+    
+    while in_flight:
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            yield in_flight.pop(future), future
+            item = next(items, None)
+            if item is not None:
+                in_flight[submit(item)] = item
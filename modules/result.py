@@ -0,0 +1,88 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from . import _json
+
+# Per-document Gemini API cost estimate (USD)
+GEMINI_COST_USD = 0.0003
+
+
+@dataclass(frozen=True)
+class ExtractResult:
+    """Per-document extraction result; the single definition of the output record shape"""
+    __slots__ = ('doc_id', 'dealer_name', 'model_name', 'horse_power', 'asset_cost',
+                 'signature_present', 'signature_bbox', 'stamp_present', 'stamp_bbox',
+                 'confidence', 'processing_time_sec', 'cost_estimate_usd', 'extraction_method')
+
+    doc_id: str
+    dealer_name: Optional[str]
+    model_name: Optional[str]
+    horse_power: Any
+    asset_cost: Any
+    signature_present: bool
+    signature_bbox: Optional[list]
+    stamp_present: bool
+    stamp_bbox: Optional[list]
+    confidence: float
+    processing_time_sec: float
+    cost_estimate_usd: float
+    extraction_method: str
+
+    @classmethod
+    def from_raw(cls, doc_id: str, raw: Optional[dict], extraction_method: str,
+                 processing_time_sec: float) -> "ExtractResult":
+        """Build from the flat dict an extractor returns (None means nothing was extracted)"""
+        if not raw:
+            return cls(doc_id, None, None, None, None, False, None, False, None,
+                       0.0, processing_time_sec, 0.0, extraction_method)
+        get = raw.get
+        return cls(doc_id, get('dealer_name'), get('model_name'), get('horse_power'),
+                   get('asset_cost'), get('signature_present', False), get('signature_bbox'),
+                   get('stamp_present', False), get('stamp_bbox'), get('confidence', 0.0),
+                   processing_time_sec,
+                   GEMINI_COST_USD if extraction_method == 'gemini' else 0.0,
+                   extraction_method)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Nested output record (as written to the JSON / JSONL output)"""
+        return {
+            "doc_id": self.doc_id,
+            "fields": {
+                "dealer_name": self.dealer_name,
+                "model_name": self.model_name,
+                "horse_power": self.horse_power,
+                "asset_cost": self.asset_cost,
+                "signature": {"present": self.signature_present, "bbox": self.signature_bbox},
+                "stamp": {"present": self.stamp_present, "bbox": self.stamp_bbox}
+            },
+            "confidence": self.confidence,
+            "processing_time_sec": self.processing_time_sec,
+            "cost_estimate_usd": self.cost_estimate_usd,
+            "extraction_method": self.extraction_method
+        }
+
+
+def load_completed(sink_path: str) -> Dict[str, Any]:
+    """Load successful results of a previous (interrupted) run from its JSONL sink"""
+    completed = {}
+    if not os.path.exists(sink_path):
+        return completed
+    
+    line = ""
+    with open(sink_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = _json.loads(line)
+            except _json.JSONDecodeError:
+                continue  # Line cut off by a crash
+            # Errors and documents no engine could extract are retried
+            if "error" not in result and result.get('extraction_method') != 'failed':
+                completed[result.get('doc_id')] = result
+    
+    if line and not line.endswith("\n"):
+        # Terminate the truncated line so appended records start cleanly
+        with open(sink_path, 'a', encoding='utf-8') as f:
+            f.write("\n")
+    
+    return completed
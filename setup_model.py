@@ -1,13 +1,34 @@
 
 import os
+import importlib.util
+
+# hf_transfer: parallel range requests for files not already served through Xet
+# (huggingface_hub reads this at import time, and errors if it is set without the package)
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
 from huggingface_hub import hf_hub_download
-import shutil
 
-MODEL_REPO = "bartowski/Qwen2.5-7B-Instruct-GGUF"
-MODEL_FILE = "Qwen2.5-7B-Instruct-Q4_K_M.gguf"
+from modules.local_llm_extractor import CUDA_INSTALL_CMD, llama_gpu_offload_supported
+
+MODEL_REPO = "bartowski/Qwen2.5-1.5B-Instruct-GGUF"
+MODEL_FILE = "Qwen2.5-1.5B-Instruct-Q4_K_M.gguf"
 DEST_DIR = "models"
 DEST_PATH = os.path.join(DEST_DIR, "model.gguf")
 
+def check_llama_build():
+    """Pre-flight check: report whether llama-cpp-python can run the model on a GPU"""
+    try:
+        import llama_cpp
+    except ImportError:
+        print("llama-cpp-python is not installed (pip install llama-cpp-python)")
+        return
+    if llama_gpu_offload_supported():
+        print(f"llama-cpp-python {llama_cpp.__version__}: GPU offload supported")
+    else:
+        print(f"llama-cpp-python {llama_cpp.__version__} is a CPU-only build; the model will run on CPU.")
+        print(f"For an NVIDIA GPU, reinstall with:\n  {CUDA_INSTALL_CMD}")
+
 def setup_model():
     if not os.path.exists(DEST_DIR):
         os.makedirs(DEST_DIR)
@@ -18,14 +39,14 @@ def setup_model():
 
     print(f"Downloading {MODEL_FILE} from {MODEL_REPO}...")
     try:
-        model_path = hf_hub_download(repo_id=MODEL_REPO, filename=MODEL_FILE)
-        print(f"Download complete: {model_path}")
-        
-        print(f"Copying to {DEST_PATH}...")
-        shutil.copy(model_path, DEST_PATH)
+        # Download straight into models/ (no copy out of the HF cache), then rename in place.
+        # An interrupted download resumes from its .incomplete file on the next run.
+        hf_hub_download(repo_id=MODEL_REPO, filename=MODEL_FILE, local_dir=DEST_DIR)
+        os.replace(os.path.join(DEST_DIR, MODEL_FILE), DEST_PATH)
         print("Model setup complete!")
     except Exception as e:
         print(f"Failed to download model: {e}")
 
 if __name__ == "__main__":
+    check_llama_build()
     setup_model()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from modules.hybrid_engine import HybridExtractor
+from modules.ocr_extractor import OCR_BATCH_SIZE
+
+
+class FakeOCR:
+    """EasyOCR stand-in that records how it was called"""
+    initialized = True
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.single_calls = 0
+
+    def extract_batch(self, image_sources):
+        self.batch_sizes.append(len(image_sources))
+        return [{"dealer_name": "ABC Motors", "confidence": 0.6} for _ in image_sources]
+
+    def extract(self, image_source):
+        self.single_calls += 1
+        return {"dealer_name": "ABC Motors", "confidence": 0.6}
+
+
+class OfflineBatchTest(unittest.TestCase):
+    def test_offline_batch_uses_batched_ocr(self):
+        extractor = HybridExtractor(use_cache=False)
+        extractor.gemini_available = False
+        extractor.easyocr_available = True
+        extractor.local_llm_available = False
+        extractor._easyocr = ocr = FakeOCR()
+
+        with tempfile.TemporaryDirectory() as d:
+            paths = []
+            for i in range(5):
+                path = os.path.join(d, f"doc{i}.png")
+                with open(path, "wb") as f:
+                    f.write(b"image %d" % i)
+                paths.append(path)
+            results = extractor.process_batch(paths, os.path.join(d, "out.json"), workers=1)
+
+        self.assertEqual(ocr.batch_sizes, [min(5, OCR_BATCH_SIZE)])
+        self.assertEqual(ocr.single_calls, 0)
+        self.assertEqual([r["extraction_method"] for r in results], ["easyocr"] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()